@@ -1,39 +1,246 @@
 import os
-import json
-import shutil
+import threading
 from datetime import datetime
+from manifest import scan_tree
+from filters import source_filter
+from history_store import HistoryStore
+from fastcopy import copy_file
+from pack_archive import PackWriter, PACK_MAX_FILE_SIZE
+from compression import CompressedPackWriter
+from content_store import ContentStore, SnapshotReader
+from metrics import METRICS
+from verify import VerifyError, copy_verified, filesystem_type, read_back_hash, resolve_algorithm
 
 ####################### ===== BackupManager ===== #######################
 class BackupManager:
-    def __init__(self):
+    def __init__(self, incremental=False, verify=None):
         self.backup_history = []
+        self.history_lock = threading.Lock()    # Backups to several targets may run in parallel
+        self.incremental = incremental          # Hard-link unchanged files from the last snapshot
+        self.verify = verify                    # None, 'fast' or 'blake2': hash copies and check them
+        self.filter_rules = []                  # Job rules on top of filters.DEFAULT_EXCLUDES and the device's own
+        self.default_excludes = True
+        self.store = HistoryStore()
         self.load_history()
     
+    def scan(self, source):
+        """scan_tree() of source with the current filter rules"""
+        return scan_tree(source, source_filter(source, self.filter_rules, self.default_excludes))
+    
     def load_history(self):
-        if os.path.exists('backup_history.json'):
-            with open('backup_history.json', 'r') as f:
-                self.backup_history = json.load(f)
+        self.backup_history = self.store.load()
+    
+    def record_backup(self, backup_info):
+        """Append a finished backup to the history (the file lists go to its own manifest)"""
+        with self.history_lock, METRICS.phase('record_history'):
+            self.backup_history.append(self.store.append(backup_info))
+    
+    def find_previous_snapshot(self, source, target):
+        """Latest backup of source on target that recorded a manifest, or None"""
+        target = os.path.normpath(target)
+        for backup in reversed(self.backup_history):
+            # Cheap summary fields first - the manifest is only loaded for a candidate
+            if (backup['source'] == source and backup.get('mode') in (None, 'full', 'incremental') and
+                    os.path.dirname(os.path.normpath(backup['backup_location'])) == target and
+                    os.path.isdir(backup['backup_location']) and backup.get('manifest') is not None):
+                return backup
+        return None
+    
+    @METRICS.job_function('backup')
+    def create_backup(self, source, target, manifest=None, incremental=None):
+        """Copy source into a new USB_Backup_<timestamp> folder on target.
+
+        Pass the manifest of an earlier scan(source) to avoid walking the source again.
+        In incremental mode files unchanged since the previous snapshot (same size and
+        mtime) are hard-linked from it, like rsync --link-dest; only changed files are copied.
+        With verify set, every copy is hashed while streaming and checked on the target;
+        the checksums are kept in the record (linked files reuse the previous ones).
+        """
+        if incremental is None:
+            incremental = self.incremental
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        backup_dir = os.path.join(target, f"USB_Backup_{timestamp}")
+        
+        try:
+            if manifest is None:
+                with METRICS.phase('scan'):
+                    manifest = self.scan(source)
+            
+            previous = self.find_previous_snapshot(source, target) if incremental else None
+            if previous and os.path.normpath(previous['backup_location']) == os.path.normpath(backup_dir):
+                previous = None
+            previous_manifest = previous['manifest'] if previous else {}
+            
+            algorithm = resolve_algorithm(self.verify)
+            fstype = filesystem_type(target) if algorithm else ''
+            previous_checksums = {}
+            if previous and algorithm and previous.get('checksum_algorithm') == algorithm:
+                previous_checksums = previous.get('checksums') or {}
+            
+            os.makedirs(backup_dir, exist_ok=True)
+            backed_up_files = []
+            new_files = []
+            linked_files = []
+            copy_methods = {}
+            checksums = {}
+            verify_failures = []
+            created_dirs = set()
+            
+            for entry in manifest:
+                dst_path = os.path.join(backup_dir, entry.rel_path)
+                
+                dst_parent = os.path.dirname(dst_path)
+                if dst_parent not in created_dirs:
+                    with METRICS.phase('backup_makedirs'):
+                        os.makedirs(dst_parent, exist_ok=True)
+                    created_dirs.add(dst_parent)
+                
+                with METRICS.time('backup_link'):
+                    linked = self._link_unchanged(entry, previous, previous_manifest, dst_path)
+                if linked:
+                    linked_files.append(entry.rel_path)
+                    if entry.rel_path in previous_checksums:
+                        checksums[entry.rel_path] = previous_checksums[entry.rel_path]
+                else:
+                    method = self._copy(manifest.source_path(entry), dst_path, entry.rel_path,
+                                        algorithm, fstype, checksums, verify_failures)
+                    copy_methods[method] = copy_methods.get(method, 0) + 1
+                    new_files.append(entry.rel_path)
+                backed_up_files.append(dst_path)
+                METRICS.count(target, 1, 0 if linked else entry.size)
+            
+            backup_info = {
+                'timestamp': timestamp,
+                'source': source,
+                'backup_location': backup_dir,
+                'backed_up_files': backed_up_files,
+                'original_files_count': len(backed_up_files),
+                'mode': 'incremental' if previous else 'full',
+                'base_backup': previous['backup_location'] if previous else None,
+                'manifest': manifest.to_record(),
+                'pruned': manifest.pruned,
+                'new_files': new_files,
+                'linked_files': linked_files,
+                'copy_methods': copy_methods
+            }
+            self._add_checksums(backup_info, algorithm, checksums, verify_failures)
+            
+            self.record_backup(backup_info)
+            return backup_info
+            
+        except Exception as e:
+            print(f"Backup failed: {e}")
+            METRICS.error(target, e)
+            return None
     
-    def save_history(self):
-        with open('backup_history.json', 'w') as f:
-            json.dump(self.backup_history, f, indent=2)
+    @METRICS.job_function('backup')
+    def create_dedup_backup(self, source, target, manifest=None):
+        """Back up source into the content-addressed store on target.
+
+        Every distinct file content is written once; the snapshot itself is only a
+        manifest pointing at blobs. Hashes of files unchanged since the previous
+        dedup snapshot of the same source are reused instead of re-reading them.
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        store = ContentStore(target)
+        
+        try:
+            if manifest is None:
+                with METRICS.phase('scan'):
+                    manifest = self.scan(source)
+            
+            previous_files = {}
+            for backup in reversed(self.backup_history):
+                if (backup.get('mode') == 'dedup' and backup['source'] == source and
+                        os.path.normpath(backup['backup_location']) == os.path.normpath(store.root) and
+                        os.path.exists(backup['snapshot'])):
+                    previous_files = ContentStore.load_snapshot(backup['snapshot'])
+                    break
+            
+            files = {}
+            new_blobs = 0
+            stored_bytes = 0
+            
+            for entry in manifest:
+                previous = previous_files.get(entry.rel_path)
+                if (previous and previous['size'] == entry.size and previous['mtime'] == entry.mtime
+                        and store.has_blob(previous['hash'])):
+                    digest = previous['hash']
+                else:
+                    digest, written = store.put_file(manifest.source_path(entry))
+                    if written:
+                        new_blobs += 1
+                        stored_bytes += entry.size
+                
+                files[entry.rel_path] = {'hash': digest, 'size': entry.size, 'mtime': entry.mtime}
+            
+            snapshot_path = store.save_snapshot(timestamp, files)
+            
+            backup_info = {
+                'timestamp': timestamp,
+                'source': source,
+                'backup_location': store.root,
+                'backed_up_files': list(files),
+                'original_files_count': len(files),
+                'mode': 'dedup',
+                'snapshot': snapshot_path,
+                'manifest': manifest.to_record(),
+                'pruned': manifest.pruned,
+                'new_blobs': new_blobs,
+                'stored_bytes': stored_bytes
+            }
+            
+            self.record_backup(backup_info)
+            return backup_info
+            
+        except Exception as e:
+            print(f"Backup failed: {e}")
+            METRICS.error(target, e)
+            return None
     
-    def create_backup(self, source, target):
+    @METRICS.job_function('backup')
+    def create_packed_backup(self, source, target, manifest=None, max_packed_size=PACK_MAX_FILE_SIZE):
+        """Back up source with all small files streamed into a single indexed archive.
+
+        Files up to max_packed_size go into USB_Backup_<timestamp>/files.pack.*, larger
+        ones are copied as regular files next to it. The history entry points into the
+        archive through 'archive_index' and 'packed_files'.
+        """
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         backup_dir = os.path.join(target, f"USB_Backup_{timestamp}")
         
         try:
+            if manifest is None:
+                with METRICS.phase('scan'):
+                    manifest = self.scan(source)
+            
             os.makedirs(backup_dir, exist_ok=True)
             backed_up_files = []
+            packed_files = []
+            copy_methods = {}
+            algorithm = resolve_algorithm(self.verify)
+            fstype = filesystem_type(target) if algorithm else ''
+            checksums = {}
+            verify_failures = []
+            created_dirs = set()
             
-            for root, _, files in os.walk(source):
-                for file in files:
-                    src_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(root, source)
-                    dst_path = os.path.join(backup_dir, rel_path, file)
+            with PackWriter(os.path.join(backup_dir, "files")) as pack:
+                for entry in manifest:
+                    if entry.size <= max_packed_size:
+                        pack.add(manifest.source_path(entry), entry.rel_path,
+                                 entry.size, entry.mtime, entry.mode)
+                        packed_files.append(entry.rel_path)
+                        continue
                     
-                    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-                    shutil.copy2(src_path, dst_path)
+                    dst_path = os.path.join(backup_dir, entry.rel_path)
+                    dst_parent = os.path.dirname(dst_path)
+                    if dst_parent not in created_dirs:
+                        with METRICS.phase('backup_makedirs'):
+                            os.makedirs(dst_parent, exist_ok=True)
+                        created_dirs.add(dst_parent)
+                    method = self._copy(manifest.source_path(entry), dst_path, entry.rel_path,
+                                        algorithm, fstype, checksums, verify_failures)
+                    copy_methods[method] = copy_methods.get(method, 0) + 1
                     backed_up_files.append(dst_path)
             
             backup_info = {
@@ -41,13 +248,197 @@ class BackupManager:
                 'source': source,
                 'backup_location': backup_dir,
                 'backed_up_files': backed_up_files,
-                'original_files_count': len(backed_up_files)
+                'original_files_count': len(backed_up_files) + len(packed_files),
+                'mode': 'packed',
+                'archive_index': pack.index_path,
+                'packed_files': packed_files,
+                'manifest': manifest.to_record(),
+                'pruned': manifest.pruned,
+                'copy_methods': copy_methods
             }
+            self._add_checksums(backup_info, algorithm, checksums, verify_failures)
             
-            self.backup_history.append(backup_info)
-            self.save_history()
+            self.record_backup(backup_info)
             return backup_info
             
         except Exception as e:
             print(f"Backup failed: {e}")
+            METRICS.error(target, e)
             return None
+    
+    @METRICS.job_function('backup')
+    def create_compressed_backup(self, source, target, manifest=None, codec=None, workers=None):
+        """Back up source into a compressed archive, compressing chunks on all cores.
+
+        codec is 'zstd' (needs the zstandard package), 'lzma' or 'zlib'; already
+        compressed files are stored as they are. The history entry records the
+        compression ratio and the throughput per core.
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        backup_dir = os.path.join(target, f"USB_Backup_{timestamp}")
+        
+        try:
+            if manifest is None:
+                with METRICS.phase('scan'):
+                    manifest = self.scan(source)
+            
+            os.makedirs(backup_dir, exist_ok=True)
+            
+            with CompressedPackWriter(os.path.join(backup_dir, "files"), codec, workers) as pack:
+                for entry in manifest:
+                    pack.add(manifest.source_path(entry), entry.rel_path,
+                             entry.size, entry.mtime, entry.mode)
+            compression = pack.stats()
+            
+            backup_info = {
+                'timestamp': timestamp,
+                'source': source,
+                'backup_location': backup_dir,
+                'backed_up_files': [],
+                'original_files_count': len(manifest),
+                'mode': 'compressed',
+                'archive_index': pack.index_path,
+                'packed_files': [entry.rel_path for entry in manifest],
+                'manifest': manifest.to_record(),
+                'pruned': manifest.pruned,
+                'compression': compression
+            }
+            
+            self.record_backup(backup_info)
+            return backup_info
+            
+        except Exception as e:
+            print(f"Backup failed: {e}")
+            METRICS.error(target, e)
+            return None
+    
+    @METRICS.job_function('backup')
+    def create_preimage_backup(self, source, target, target_dir, overwritten, created=()):
+        """Back up only the current versions of the target files a sync is about to overwrite.
+
+        overwritten and created are paths relative to target_dir. The record keeps both
+        lists, so rollback() can put the old versions back and remove the new files.
+        """
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        backup_dir = os.path.join(target, f"USB_Backup_{timestamp}")
+        
+        try:
+            os.makedirs(backup_dir, exist_ok=True)
+            backed_up_files = []
+            copy_methods = {}
+            algorithm = resolve_algorithm(self.verify)
+            fstype = filesystem_type(target) if algorithm else ''
+            checksums = {}
+            verify_failures = []
+            created_dirs = set()
+            
+            for rel_path in overwritten:
+                dst_path = os.path.join(backup_dir, rel_path)
+                
+                dst_parent = os.path.dirname(dst_path)
+                if dst_parent not in created_dirs:
+                    with METRICS.phase('backup_makedirs'):
+                        os.makedirs(dst_parent, exist_ok=True)
+                    created_dirs.add(dst_parent)
+                method = self._copy(os.path.join(target_dir, rel_path), dst_path, rel_path,
+                                    algorithm, fstype, checksums, verify_failures)
+                copy_methods[method] = copy_methods.get(method, 0) + 1
+                backed_up_files.append(dst_path)
+            
+            backup_info = {
+                'timestamp': timestamp,
+                'source': source,
+                'backup_location': backup_dir,
+                'backed_up_files': backed_up_files,
+                'original_files_count': len(backed_up_files),
+                'mode': 'preimage',
+                'restore_root': target_dir,
+                'created_files': list(created),
+                'copy_methods': copy_methods
+            }
+            self._add_checksums(backup_info, algorithm, checksums, verify_failures)
+            
+            self.record_backup(backup_info)
+            return backup_info
+            
+        except Exception as e:
+            print(f"Backup failed: {e}")
+            METRICS.error(target, e)
+            return None
+    
+    def rollback(self, backup_info):
+        """Undo the sync that a pre-image backup was taken for; USBModel.rollback also resets the sync index"""
+        restored = self.restore_snapshot(backup_info, backup_info['restore_root'])
+        for rel_path in backup_info.get('created_files', []):
+            try:
+                os.remove(os.path.join(backup_info['restore_root'], rel_path))
+            except OSError:
+                pass
+        return restored
+    
+    def list_snapshot(self, backup_info):
+        """Relative paths of the files in any backup from the history"""
+        return SnapshotReader(backup_info).list_files()
+    
+    def restore_snapshot(self, backup_info, destination, paths=None, verify=False):
+        """Materialize any backup from the history into destination.
+
+        With verify, restored files are checked against the checksums stored at backup time.
+        """
+        restored = SnapshotReader(backup_info).materialize(destination, paths)
+        if verify:
+            for rel_path in self.verify_restored(backup_info, destination, paths):
+                print(f"Restored file does not match its backup checksum: {rel_path}")
+        return restored
+    
+    def verify_restored(self, backup_info, destination, paths=None):
+        """Relative paths under destination whose content differs from the recorded checksums.
+
+        Only the restored files are read; files without a stored checksum are not checked.
+        """
+        algorithm = backup_info.get('checksum_algorithm')
+        checksums = backup_info.get('checksums') or {}
+        mismatched = []
+        if not algorithm:
+            return mismatched
+        for rel_path in (paths if paths is not None else checksums):
+            if rel_path not in checksums:
+                continue
+            try:
+                if read_back_hash(os.path.join(destination, rel_path), algorithm) != checksums[rel_path]:
+                    mismatched.append(rel_path)
+            except OSError:
+                mismatched.append(rel_path)
+        return mismatched
+    
+    def _copy(self, src_path, dst_path, rel_path, algorithm, fstype, checksums, verify_failures):
+        """Copy one file, hashing and verifying it when algorithm is set; returns the method"""
+        if not algorithm:
+            with METRICS.time('backup_copy'):
+                return copy_file(src_path, dst_path)
+        try:
+            with METRICS.time('backup_copy'):
+                digest, method = copy_verified(src_path, dst_path, algorithm, fstype)
+            checksums[rel_path] = digest
+            return method
+        except VerifyError as e:
+            print(e)
+            verify_failures.append(rel_path)
+            return 'failed'
+    
+    def _add_checksums(self, backup_info, algorithm, checksums, verify_failures):
+        if algorithm:
+            backup_info['checksum_algorithm'] = algorithm
+            backup_info['checksums'] = checksums
+            backup_info['verify_failures'] = verify_failures
+    
+    def _link_unchanged(self, entry, previous, previous_manifest, dst_path):
+        """Hard-link dst_path to the previous snapshot's copy if the file did not change"""
+        if not previous or previous_manifest.get(entry.rel_path) != [entry.size, entry.mtime]:
+            return False
+        try:
+            os.link(os.path.join(previous['backup_location'], entry.rel_path), dst_path)
+            return True
+        except OSError:
+            # Missing in the old snapshot or no hard links on this filesystem (FAT/exFAT)
+            return False
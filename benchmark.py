@@ -0,0 +1,267 @@
+# Benchmarks of the copy paths on synthetic trees and fake devices
+#   python benchmark.py                         all trees, all cases
+#   python benchmark.py --tree tiny --scale 0.1 --out before.json
+#   python benchmark.py --compare before.json   run again and print the change per case
+# Every case runs in its own process, so peak RSS belongs to that case alone.
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+import multiprocessing
+
+TREES = ('tiny', 'huge', 'deep', 'mixed')
+CASES = ('transfer', 'sync_cold', 'sync_nochange', 'create_backup', 'perform_backup')
+
+####################### ===== FakeDeviceProvider ===== #######################
+class FakeDeviceProvider:
+    """Stands in for psutil: every fake device is a directory under root.
+
+    Pass an instance as USBModel(device_provider=...); it returns device dicts in the
+    format of USBModel.get_usb_devices(). Each device gets its own fake block device
+    name, so the per-device worker limits treat them as separate sticks.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.devices = []
+
+    def add_device(self, label, fstype='vfat', mountpoint=None):
+        """Register a device; an existing directory can be passed as its mount point"""
+        mountpoint = mountpoint or os.path.join(self.root, label)
+        os.makedirs(mountpoint, exist_ok=True)
+        self.devices.append({'device': f"/dev/fake{len(self.devices)}", 'mountpoint': mountpoint,
+                             'fstype': fstype, 'label': label})
+        return mountpoint
+
+    def __call__(self):
+        devices = []
+        for device in self.devices:
+            usage = shutil.disk_usage(device['mountpoint'])
+            devices.append(dict(device, total=usage.total, used=usage.used, free=usage.free))
+        return devices
+
+####################### ===== Synthetic trees ===== #######################
+def _write_file(path, size, rng):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        # Random blocks repeated, so generating gigabytes stays cheap
+        block = rng.randbytes(min(size, 1024 * 1024)) if size else b''
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+def make_tree(root, kind, scale=1.0, seed=1):
+    """Create a synthetic source tree; returns (files, bytes)"""
+    rng = random.Random(seed)
+    files = []
+    if kind in ('tiny', 'mixed'):
+        count = max(1, int(20000 * scale))
+        files += [(os.path.join(root, 'tiny', f"d{i // 200:03d}", f"f{i:05d}.txt"), rng.randint(0, 4096))
+                  for i in range(count)]
+    if kind in ('huge', 'mixed'):
+        count = 3
+        size = max(1024 * 1024, int(512 * 1024 * 1024 * scale))
+        files += [(os.path.join(root, 'huge', f"big{i}.bin"), size) for i in range(count)]
+    if kind in ('deep', 'mixed'):
+        count = max(1, int(2000 * scale))
+        for i in range(count):
+            depth = 1 + i % 40
+            parts = [f"level{level}" for level in range(depth)]
+            files.append((os.path.join(root, 'deep', f"branch{i % 10}", *parts, f"f{i}.dat"),
+                          rng.randint(1024, 64 * 1024)))
+
+    total = 0
+    for path, size in files:
+        _write_file(path, size, rng)
+        total += size
+    return len(files), total
+
+####################### ===== Measurement ===== #######################
+def _io_counts():
+    """(read calls, write calls) of this process, or (None, None) where not available"""
+    try:
+        import psutil
+        counters = psutil.Process().io_counters()
+        return counters.read_count, counters.write_count
+    except Exception:
+        return None, None
+
+def _peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes on Linux, bytes on macOS
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024)
+
+class _HeadlessView:
+    """Just enough of USBView for USBController._perform_backup"""
+    class _Widget:
+        def config(self, **kwargs):
+            pass
+
+    class _Root:
+        def after(self, delay, func=None, *args):
+            pass
+
+    def __init__(self):
+        self.root = self._Root()
+        self.sync_btn = self.refresh_btn = self.backup_btn = self._Widget()
+
+    def log_message(self, message):
+        pass
+
+    def show_notification(self, title, message):
+        pass
+
+def _perform_backup(model, source, targets):
+    from types import SimpleNamespace
+    from progress import ProgressChannel
+    from controller import USBController    # Needs tkinter and sv_ttk installed
+    devices = {device['mountpoint']: device for device in model.get_usb_devices()}
+    controller = SimpleNamespace(model=model, view=_HeadlessView(), progress=ProgressChannel(),
+                                 pack_small_files=False)
+    USBController._perform_backup(controller, devices[source], [devices[target] for target in targets])
+
+def _run_case(case, source_root, workdir, targets, queue):
+    """Body of one case process; puts the measurement into queue"""
+    try:
+        os.chdir(workdir)    # Backup history and sync indexes land in the scratch directory
+        from model import USBModel
+        from manifest import scan_tree
+
+        provider = FakeDeviceProvider(os.path.join(workdir, 'devices'))
+        source = provider.add_device('SOURCE', 'ext4', source_root)
+        target_paths = [provider.add_device(f"TARGET{i}") for i in range(targets)]
+        model = USBModel(device_provider=provider)
+        manifest = scan_tree(source)
+        files, nbytes = len(manifest), manifest.total_bytes
+
+        if case == 'sync_nochange':
+            # Untimed first pass, the measured one finds nothing to copy
+            model.sync_with_backup(source, target_paths, lambda *args: None)
+
+        reads, writes = _io_counts()
+        start = time.perf_counter()
+        if case == 'transfer':
+            model.transfer_data(source, target_paths, lambda *args: None)
+        elif case in ('sync_cold', 'sync_nochange'):
+            model.sync_with_backup(source, target_paths, lambda *args: None)
+        elif case == 'create_backup':
+            for target in target_paths:
+                model.backup_manager.create_backup(source, target, manifest)
+        elif case == 'perform_backup':
+            _perform_backup(model, source, target_paths)
+        seconds = time.perf_counter() - start
+        reads_after, writes_after = _io_counts()
+
+        work_files = files * targets
+        work_bytes = nbytes * targets
+        queue.put({
+            'case': case,
+            'seconds': round(seconds, 4),
+            'files': work_files,
+            'bytes': work_bytes,
+            'files_per_s': round(work_files / seconds, 1) if seconds else None,
+            'mb_per_s': round(work_bytes / seconds / (1024 * 1024), 2) if seconds else None,
+            'read_syscalls': reads_after - reads if reads is not None else None,
+            'write_syscalls': writes_after - writes if writes is not None else None,
+            'peak_rss_mb': round(_peak_rss_mb(), 1)
+        })
+    except ImportError as e:
+        queue.put({'case': case, 'skipped': str(e)})
+    except Exception as e:
+        queue.put({'case': case, 'error': repr(e)})
+
+def run_case(case, source_root, targets=2):
+    """Run one case in a fresh process on a scratch copy of the devices"""
+    workdir = tempfile.mkdtemp(prefix=f"usbbench_{case}_")
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run_case, args=(case, source_root, workdir, targets, queue))
+    process.start()
+    try:
+        result = queue.get()
+    finally:
+        process.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_suite(trees=TREES, cases=CASES, scale=1.0, targets=2):
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'targets': targets,
+        'trees': {}
+    }
+    for kind in trees:
+        source_root = tempfile.mkdtemp(prefix=f"usbbench_src_{kind}_")
+        try:
+            files, nbytes = make_tree(source_root, kind, scale)
+            results = []
+            for case in cases:
+                result = run_case(case, source_root, targets)
+                print(f"{kind:6} {case:15} {json.dumps(result)}")
+                results.append(result)
+            report['trees'][kind] = {'files': files, 'bytes': nbytes, 'results': results}
+        finally:
+            shutil.rmtree(source_root, ignore_errors=True)
+    return report
+
+def compare(old, new):
+    """Lines describing the change of seconds and peak RSS per tree and case"""
+    lines = []
+    for kind, tree in new['trees'].items():
+        old_results = {result['case']: result for result in old.get('trees', {}).get(kind, {}).get('results', [])}
+        for result in tree['results']:
+            before = old_results.get(result['case'])
+            if not before or 'seconds' not in before or 'seconds' not in result:
+                continue
+            change = (result['seconds'] - before['seconds']) / before['seconds'] * 100 if before['seconds'] else 0
+            lines.append(f"{kind:6} {result['case']:15} {before['seconds']:9.3f}s -> {result['seconds']:9.3f}s "
+                         f"({change:+.1f}%), RSS {before['peak_rss_mb']} -> {result['peak_rss_mb']} MB")
+    return lines
+
+####################### ===== main ===== #######################
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the USB Nion Data Sync copy paths")
+    parser.add_argument('--tree', action='append', choices=TREES, help="tree kinds to run (default: all)")
+    parser.add_argument('--case', action='append', choices=CASES, help="cases to run (default: all)")
+    parser.add_argument('--scale', type=float, default=1.0, help="size factor of the synthetic trees")
+    parser.add_argument('--targets', type=int, default=2, help="fake target devices per case")
+    parser.add_argument('--out', default=f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    parser.add_argument('--compare', help="earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.tree or TREES, args.case or CASES, args.scale, args.targets)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.out}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            for line in compare(json.load(f), report):
+                print(line)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import uuid
+
+DEFAULT_CLUSTER_SIZE = 4096
+SPACE_RESERVE = 16 * 1024 * 1024    # Kept free on every target for journals, indexes and directory entries
+FAT_MAX_FILE_SIZE = 4 * 1024 * 1024 * 1024 - 1
+FAT_FILESYSTEMS = {'vfat', 'fat', 'fat16', 'fat32', 'msdos'}
+SPAN_MANIFEST = ".usb_sync_span.json"
+MAX_PROBLEM_FILES = 5    # Files named per problem message
+
+def cluster_size(path):
+    """Allocation unit of the filesystem holding path"""
+    try:
+        return os.statvfs(path).f_frsize or DEFAULT_CLUSTER_SIZE
+    except (AttributeError, OSError):
+        return DEFAULT_CLUSTER_SIZE
+
+def allocated_size(size, cluster=DEFAULT_CLUSTER_SIZE):
+    """Space a file of size bytes takes on disk: whole clusters"""
+    return -(-size // cluster) * cluster
+
+def max_file_size(fstype):
+    """Largest single file the filesystem can hold, None for no practical limit"""
+    return FAT_MAX_FILE_SIZE if (fstype or '').lower() in FAT_FILESYSTEMS else None
+
+def reclaimable_bytes(entries, target_dir, cluster=DEFAULT_CLUSTER_SIZE):
+    """Space freed by overwriting the files of entries that already exist in target_dir"""
+    if not os.path.isdir(target_dir):
+        return 0
+    reclaimed = 0
+    for entry in entries:
+        try:
+            reclaimed += allocated_size(os.stat(os.path.join(target_dir, entry.rel_path)).st_size, cluster)
+        except OSError:
+            continue
+    return reclaimed
+
+def _names(entries):
+    names = ", ".join(entry.rel_path for entry in entries[:MAX_PROBLEM_FILES])
+    return names + (f" and {len(entries) - MAX_PROBLEM_FILES} more" if len(entries) > MAX_PROBLEM_FILES else "")
+
+def _mb(nbytes):
+    return f"{nbytes / (1024 * 1024):.1f} MB"
+
+####################### ===== Pre-flight check ===== #######################
+def check_target(entries, target, target_dir, free, fstype='', also=()):
+    """Whether all of entries fit into target_dir on the device mounted at target.
+
+    also lists files written elsewhere on the target in the same job (e.g. a backup).
+    Returns {'target', 'free', 'required', 'reclaimed', 'too_large', 'fits', 'problem'};
+    required counts whole clusters per file plus SPACE_RESERVE, reclaimed is the space
+    of files in target_dir the copy overwrites.
+    """
+    cluster = cluster_size(target)
+    limit = max_file_size(fstype)
+    required = SPACE_RESERVE + sum(allocated_size(entry.size, cluster) for entry in entries) + \
+        sum(allocated_size(entry.size, cluster) for entry in also)
+    reclaimed = reclaimable_bytes(entries, target_dir, cluster)
+    too_large = [entry for entry in list(entries) + list(also) if limit and entry.size > limit]
+    too_large = list({entry.rel_path: entry for entry in too_large}.values())
+
+    problem = None
+    if too_large:
+        problem = (f"{os.path.basename(target) or target}: {len(too_large)} file(s) exceed the "
+                   f"{fstype} file size limit: {_names(too_large)}")
+    elif required - reclaimed > free:
+        problem = (f"{os.path.basename(target) or target}: needs {_mb(required - reclaimed)}, "
+                   f"only {_mb(free)} free")
+    return {
+        'target': target,
+        'free': free,
+        'required': required,
+        'reclaimed': reclaimed,
+        'too_large': [entry.rel_path for entry in too_large],
+        'fits': problem is None,
+        'problem': problem
+    }
+
+####################### ===== Spanning ===== #######################
+def plan_span(entries, targets):
+    """Split entries across targets that are each too small for all of them.
+
+    targets is a list of {'target', 'target_dir', 'free', 'fstype'} dicts. Files are
+    placed largest first, each on the target with the most space left that can hold it
+    (worst-fit decreasing), which keeps the parts of similar size so the targets finish
+    at about the same time. Returns {'ok', 'parts', 'unplaced', 'problems'}; every part
+    is the target dict plus its 'entries' (in source order), 'bytes' and 'required'.
+    """
+    parts = []
+    for target in targets:
+        cluster = cluster_size(target['target'])
+        parts.append(dict(target, entries=[], bytes=0, required=0, cluster=cluster,
+                          limit=max_file_size(target.get('fstype')),
+                          left=target['free'] - SPACE_RESERVE))
+
+    order = {entry.rel_path: position for position, entry in enumerate(entries)}
+    unplaced = []
+    for entry in sorted(entries, key=lambda entry: entry.size, reverse=True):
+        best = None
+        for part in parts:
+            if part['limit'] and entry.size > part['limit']:
+                continue
+            needed = allocated_size(entry.size, part['cluster'])
+            if needed <= part['left'] and (best is None or part['left'] > best['left']):
+                best = part
+        if best is None:
+            unplaced.append(entry)
+            continue
+        needed = allocated_size(entry.size, best['cluster'])
+        best['left'] -= needed
+        best['required'] += needed
+        best['bytes'] += entry.size
+        best['entries'].append(entry)
+
+    for part in parts:
+        # Written in source order, so every target is filled directory by directory
+        part['entries'].sort(key=lambda entry: order[entry.rel_path])
+        for key in ('cluster', 'limit', 'left'):
+            del part[key]
+
+    problems = []
+    if unplaced:
+        missing = sum(entry.size for entry in unplaced)
+        problems.append(f"{len(unplaced)} file(s) ({_mb(missing)}) do not fit on the selected targets: "
+                        f"{_names(unplaced)}")
+    return {
+        'ok': not unplaced,
+        'parts': [part for part in parts if part['entries']],
+        'unplaced': [entry.rel_path for entry in unplaced],
+        'problems': problems
+    }
+
+def new_span_id():
+    return uuid.uuid4().hex
+
+def write_span_manifest(part, number, parts, source, span_id):
+    """Record on a target which files of the spanned source it holds; returns the manifest path.
+
+    part is one entry of plan_span()['parts']; every target of the set gets its own
+    manifest with the same span_id and the totals of the whole set.
+    """
+    record = {
+        'span_id': span_id,
+        'source': os.path.basename(source.rstrip(os.sep)),
+        'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'part': number,
+        'parts': len(parts),
+        'total_files': sum(len(other['entries']) for other in parts),
+        'total_bytes': sum(other['bytes'] for other in parts),
+        'files': {entry.rel_path: [entry.size, entry.mtime] for entry in part['entries']}
+    }
+    path = os.path.join(part['target_dir'], SPAN_MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(record, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+    return path
+
+def read_span_set(part_dirs):
+    """Load the span manifests of part_dirs and check that they form one complete set.
+
+    Returns (manifests in part order, problems); the set is complete when problems is empty.
+    """
+    manifests = []
+    problems = []
+    for part_dir in part_dirs:
+        try:
+            with open(os.path.join(part_dir, SPAN_MANIFEST), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            problems.append(f"{part_dir}: no readable span manifest ({e})")
+            continue
+        manifest['dir'] = part_dir
+        manifests.append(manifest)
+
+    if manifests:
+        span_ids = {manifest['span_id'] for manifest in manifests}
+        if len(span_ids) > 1:
+            problems.append("The parts belong to different spanned copies")
+        expected = manifests[0]['parts']
+        found = {manifest['part'] for manifest in manifests}
+        missing = sorted(set(range(1, expected + 1)) - found)
+        if missing:
+            problems.append(f"Missing part(s) {', '.join(map(str, missing))} of {expected}")
+    manifests.sort(key=lambda manifest: manifest['part'])
+    return manifests, problems
@@ -0,0 +1,297 @@
+# Headless entry point - drives USBModel and BackupManager without Tk
+#   python cli.py devices
+#   python cli.py transfer --source STICK --target A --target B
+#   python cli.py transfer --source STICK --target A --target B --span
+#   python cli.py reassemble --part A/STICK --part B/STICK --target DISK
+#   python cli.py sync --source STICK --target A --backup-mode preimage
+#   python cli.py sync --source STICK --target A --reindex     (after the target was edited elsewhere)
+#   python cli.py backup --source STICK --target A --mode incremental
+#   python cli.py daemon --queue jobs/
+#   python cli.py --exclude '*.tmp' --exclude 'build/' --include 'build/keep.txt' transfer ...
+# Progress and results are printed to stdout as one JSON object per line; everything
+# else the model prints goes to stderr.
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from model import USBModel
+from progress import ProgressChannel
+from metrics import METRICS
+from filters import load_rules
+
+CLI_FRAME_RATE = 2           # Progress lines per second and operation
+QUEUE_POLL_INTERVAL = 2.0    # Seconds between scans of the daemon's job queue
+BACKUP_MODES = ('full', 'incremental', 'dedup', 'packed', 'compressed')
+OUTPUT = sys.stdout          # Where emit() writes; main() sends plain print() output to stderr
+
+def emit(event, **fields):
+    """Write one JSON event line to stdout"""
+    fields['event'] = event
+    fields['time'] = round(time.time(), 3)
+    OUTPUT.write(json.dumps(fields, default=str) + '\n')
+    OUTPUT.flush()
+
+####################### ===== JsonProgressPrinter ===== #######################
+class JsonProgressPrinter(threading.Thread):
+    """Drains a ProgressChannel at a fixed rate and prints every update as a JSON line"""
+    def __init__(self, channel, frame_rate=CLI_FRAME_RATE):
+        super().__init__(daemon=True)
+        self.channel = channel
+        self.interval = 1.0 / frame_rate
+        self.stop_event = threading.Event()
+
+    def flush(self):
+        for operation_type, progress, message, remaining, file_rate, byte_rate in self.channel.drain():
+            emit('progress', operation=operation_type, progress=round(progress, 2), message=message,
+                 remaining=round(remaining or 0, 1), file_rate=file_rate, byte_rate=byte_rate)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.flush()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+        self.flush()
+
+def resolve_device(spec, devices):
+    """Mount point for a device given by label or mount point; plain directories are accepted too"""
+    for device in devices:
+        if spec == device['label'] or os.path.normpath(spec) == os.path.normpath(device['mountpoint']):
+            return device['mountpoint']
+    if os.path.isdir(spec):
+        return spec
+    raise ValueError(f"No device with label or mount point '{spec}'")
+
+####################### ===== CliRunner ===== #######################
+class CliRunner:
+    """Runs transfer, sync and backup jobs against a USBModel and reports them as JSON.
+
+    filter_rules apply to every job; a job dict may add its own 'exclude' and 'include'
+    patterns (includes win) and switch off the defaults with 'default_excludes': false.
+    """
+    def __init__(self, model, filter_rules=None, default_excludes=True):
+        self.model = model
+        self.progress = ProgressChannel()
+        self.filter_rules = list(filter_rules or [])
+        self.default_excludes = default_excludes
+
+    def run_job(self, job):
+        """Run one job dict {'command', 'source', 'targets', ...}; returns the result event fields"""
+        if job['command'] == 'reassemble':
+            return self.reassemble(job.get('parts', []), resolve_device(job['target'], self.model.get_usb_devices()))
+        self.model.set_filters(self.filter_rules + list(job.get('exclude') or []) +
+                               ['!' + pattern for pattern in job.get('include') or []],
+                               job.get('default_excludes', self.default_excludes))
+        devices = self.model.get_usb_devices()
+        source = resolve_device(job['source'], devices)
+        targets = [resolve_device(target, devices) for target in job.get('targets', [])]
+        if not targets:
+            raise ValueError("No target given")
+        if any(os.path.normpath(target) == os.path.normpath(source) for target in targets):
+            raise ValueError("Source cannot be a target")
+
+        command = job['command']
+        printer = JsonProgressPrinter(self.progress)
+        printer.start()
+        try:
+            if command == 'transfer' and job.get('span'):
+                done = self.model.span_data(source, targets, self.progress.reporter('transfer'))
+                plan = self.model.last_span_plan or {'parts': [], 'problems': []}
+                return {'ok': bool(done) and len(done) == len(plan['parts']), 'targets': done,
+                        'parts': [{'target': part['target'], 'files': len(part['entries']), 'bytes': part['bytes']}
+                                  for part in plan['parts']],
+                        'problems': plan['problems'], 'pruned': self.model.last_pruned}
+            if command == 'transfer':
+                done = self.model.transfer_data(source, targets, self.progress.reporter('transfer'))
+                # A target that lost files is reported, but the job did not succeed
+                errors = self.model.last_target_errors
+                return {'ok': bool(done) and not any(errors.values()), 'targets': done, 'errors': errors,
+                        'resumed_bytes': self.model.resumed_bytes,
+                        'problems': [check['problem'] for check in self.model.last_capacity if check['problem']],
+                        'pruned': self.model.last_pruned}
+            if command == 'sync':
+                if job.get('reindex'):
+                    for target in targets:
+                        self.model.invalidate_index(target)
+                default_mode = self.model.sync_backup_mode
+                self.model.sync_backup_mode = job.get('backup_mode', default_mode)
+                try:
+                    results = self.model.sync_with_backup(source, targets, self.progress.reporter('sync'))
+                finally:
+                    self.model.sync_backup_mode = default_mode
+                return {'ok': len(results) == len(targets) and not any(result['errors'] for result in results),
+                        'targets': [{'target': result['target'],
+                                     'backup_location': result['backup_info']['backup_location'],
+                                     'copy_methods': result['copy_methods'],
+                                     'errors': result['errors']} for result in results],
+                        'pruned': self.model.last_pruned}
+            if command == 'backup':
+                return self.backup(source, targets, job.get('mode', 'full'))
+            raise ValueError(f"Unknown command '{command}'")
+        finally:
+            printer.stop()
+
+    def backup(self, source, targets, mode):
+        manager = self.model.backup_manager
+        manifest = self.model.scan_source(source)
+        results = []
+        for done, target in enumerate(targets):
+            self.progress.publish(done / len(targets) * 100, f"Backing up to {target}", 0, 'backup')
+            if mode == 'dedup':
+                backup_info = manager.create_dedup_backup(source, target, manifest)
+            elif mode == 'packed':
+                backup_info = manager.create_packed_backup(source, target, manifest)
+            elif mode == 'compressed':
+                backup_info = manager.create_compressed_backup(source, target, manifest)
+            else:
+                backup_info = manager.create_backup(source, target, manifest, incremental=mode == 'incremental')
+            results.append({'target': target, 'ok': backup_info is not None,
+                            'backup_location': backup_info['backup_location'] if backup_info else None,
+                            'files': backup_info['original_files_count'] if backup_info else 0})
+        self.progress.publish(100, "Backup finished", 0, 'backup')
+        return {'ok': all(result['ok'] for result in results), 'targets': results,
+                'pruned': manifest.pruned}
+
+    def reassemble(self, parts, destination):
+        printer = JsonProgressPrinter(self.progress)
+        printer.start()
+        try:
+            target_dir = self.model.reassemble_span(parts, destination, self.progress.reporter('reassemble'))
+        finally:
+            printer.stop()
+        return {'ok': target_dir is not None, 'target_dir': target_dir}
+    
+    def run_and_report(self, job):
+        """run_job() with the outcome printed as a 'result' or 'error' event; True on success"""
+        try:
+            result = self.run_job(job)
+            emit('result', command=job.get('command'), **result)
+            return result['ok']
+        except Exception as e:
+            emit('error', command=job.get('command'), message=str(e))
+            return False
+
+    def serve(self, queue_dir, interval=QUEUE_POLL_INTERVAL, once=False):
+        """Daemon mode: run the job files dropped into queue_dir, oldest first.
+
+        A job file is a JSON object like the command line arguments, e.g.
+        {"command": "transfer", "source": "STICK", "targets": ["A", "B"]}. Finished
+        jobs move to queue_dir/done or queue_dir/failed with the outcome added. Write
+        job files under another name first and rename them to *.json when complete.
+        """
+        for name in ('done', 'failed'):
+            os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+        emit('daemon', status='started', queue=os.path.abspath(queue_dir))
+
+        while True:
+            jobs = sorted((entry for entry in os.scandir(queue_dir)
+                           if entry.is_file() and entry.name.endswith('.json')),
+                          key=lambda entry: entry.stat().st_mtime)
+            for entry in jobs:
+                try:
+                    with open(entry.path, 'r') as f:
+                        job = json.load(f)
+                except (OSError, ValueError) as e:
+                    emit('error', job=entry.name, message=f"Unreadable job file: {e}")
+                    os.replace(entry.path, os.path.join(queue_dir, 'failed', entry.name))
+                    continue
+
+                emit('job', job=entry.name, status='started')
+                ok = self.run_and_report(job)
+                job['ok'] = ok
+                job['finished'] = time.strftime("%Y-%m-%d %H:%M:%S")
+                with open(os.path.join(queue_dir, 'done' if ok else 'failed', entry.name), 'w') as f:
+                    json.dump(job, f, indent=2)
+                os.remove(entry.path)
+            if once:
+                return
+            time.sleep(interval)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="USB Nion Data Sync without GUI")
+    parser.add_argument('--verify', choices=('fast', 'blake2'), help="hash copies and check them on the targets")
+    parser.add_argument('--workers-per-device', type=int, default=1, help="parallel jobs per physical device")
+    parser.add_argument('--metrics', metavar='DIR',
+                        help="write a JSON report per job and a Prometheus textfile into DIR")
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help="skip matching files and folders (.gitignore syntax, 're:' for a regex)")
+    parser.add_argument('--include', action='append', default=[], metavar='PATTERN',
+                        help="copy matching paths even if an exclude matches them")
+    parser.add_argument('--filter-file', help="file with one filter rule per line, '!' re-includes")
+    parser.add_argument('--no-default-excludes', action='store_true',
+                        help="also copy system folders like 'System Volume Information' and build caches")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('devices', help="list connected devices")
+
+    for name, text in (('transfer', "copy the source into every target"),
+                       ('sync', "back up, then synchronize the source into every target"),
+                       ('backup', "create a backup of the source on every target")):
+        command = commands.add_parser(name, help=text)
+        command.add_argument('--source', required=True, help="label or mount point")
+        command.add_argument('--target', action='append', required=True, dest='targets',
+                             help="label or mount point (repeat for several targets)")
+        if name == 'sync':
+            command.add_argument('--backup-mode', choices=('full', 'preimage'), default='full')
+            command.add_argument('--reindex', action='store_true',
+                                 help="forget the targets' sync index and compare every file")
+        if name == 'transfer':
+            command.add_argument('--span', action='store_true',
+                                 help="split the source across the targets instead of copying it to each")
+        if name == 'backup':
+            command.add_argument('--mode', choices=BACKUP_MODES, default='full')
+
+    reassemble = commands.add_parser('reassemble', help="put a spanned transfer back together")
+    reassemble.add_argument('--part', action='append', required=True, dest='parts',
+                            help="folder of one part, e.g. the source folder on a target (repeat for every part)")
+    reassemble.add_argument('--target', required=True, help="directory to reassemble into")
+
+    daemon = commands.add_parser('daemon', help="run queued job files from a directory")
+    daemon.add_argument('--queue', required=True, help="directory polled for *.json job files")
+    daemon.add_argument('--interval', type=float, default=QUEUE_POLL_INTERVAL)
+    daemon.add_argument('--once', action='store_true', help="run the queued jobs and exit")
+    return parser
+
+####################### ===== main ===== #######################
+def main(argv=None):
+    global OUTPUT
+    args = build_parser().parse_args(argv)
+    # The model and BackupManager report errors with print(); keep stdout for JSON lines only
+    OUTPUT, sys.stdout = sys.stdout, sys.stderr
+    try:
+        return _run(args)
+    finally:
+        sys.stdout = OUTPUT
+
+def _run(args):
+    if args.metrics:
+        METRICS.configure(args.metrics)
+    model = USBModel(max_workers_per_device=args.workers_per_device, verify=args.verify)
+    if args.filter_file and not os.path.isfile(args.filter_file):
+        emit('error', message=f"No filter file {args.filter_file}")
+        return 2
+    rules = (load_rules(args.filter_file) if args.filter_file else []) + args.exclude + \
+        ['!' + pattern for pattern in args.include]
+    runner = CliRunner(model, rules, not args.no_default_excludes)
+
+    if args.command == 'devices':
+        emit('devices', devices=model.get_usb_devices())
+        return 0
+    if args.command == 'daemon':
+        try:
+            runner.serve(args.queue, args.interval, args.once)
+        except KeyboardInterrupt:
+            emit('daemon', status='stopped')
+        return 0
+
+    job = {key: value for key, value in vars(args).items()
+           if key in ('command', 'source', 'targets', 'backup_mode', 'mode', 'span', 'parts', 'target', 'reindex')
+           and value is not None}
+    return 0 if runner.run_and_report(job) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
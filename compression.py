@@ -0,0 +1,191 @@
+import os
+import json
+import math
+import time
+import zlib
+import lzma
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import zstandard
+except ImportError:    # Optional - falls back to the stdlib codecs
+    zstandard = None
+
+COMPRESS_CHUNK_SIZE = 4 * 1024 * 1024
+COMPRESS_VOLUME_SIZE = 4 * 1024 ** 3 - 1    # FAT32 cannot hold files of 4 GB or more
+ENTROPY_SAMPLE_SIZE = 64 * 1024
+ENTROPY_LIMIT = 7.5    # Bits per byte above which a sample is treated as already compressed
+
+# Formats that are compressed already; compressing them again only burns CPU
+STORED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.mp3', '.aac', '.ogg', '.flac',
+    '.mp4', '.mkv', '.avi', '.mov', '.webm', '.zip', '.7z', '.rar', '.gz', '.bz2',
+    '.xz', '.zst', '.lz4', '.cab', '.msi', '.apk', '.jar', '.docx', '.xlsx', '.pptx', '.pdf',
+}
+
+def available_codec(preferred=None):
+    """zstd when the zstandard package is installed, otherwise lzma (or the preferred codec)"""
+    if preferred in ('lzma', 'zlib') or (preferred == 'zstd' and zstandard):
+        return preferred
+    return 'zstd' if zstandard else 'lzma'
+
+def compress_chunk(codec, data):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == 'lzma':
+        return lzma.compress(data, preset=1)
+    return zlib.compress(data, 6)
+
+def decompress_chunk(codec, data):
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'lzma':
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+def sample_entropy(data):
+    """Shannon entropy of a sample in bits per byte (8.0 = random)"""
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(count / total * math.log2(count / total) for count in Counter(data).values())
+
+def is_compressible(path, first_chunk):
+    if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+        return False
+    return sample_entropy(first_chunk[:ENTROPY_SAMPLE_SIZE]) < ENTROPY_LIMIT
+
+####################### ===== CompressedPackWriter ===== #######################
+class CompressedPackWriter:
+    """Streams files into a compressed archive, compressing chunks on all cores.
+
+    Chunks go to a process pool and are written back in their original order as they
+    finish, with at most a few chunks per worker in flight, so memory stays bounded.
+    Already-compressed files (by extension or by a sampled entropy check) are stored
+    as-is. The index <base>.zpack.idx maps each file to its chunks.
+    """
+    def __init__(self, base_path, codec=None, workers=None, chunk_size=COMPRESS_CHUNK_SIZE,
+                 volume_size=COMPRESS_VOLUME_SIZE):
+        self.base_path = base_path
+        self.codec = available_codec(codec)
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.volume_size = volume_size
+        self.index_path = base_path + '.zpack.idx'
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.pending = deque()    # (chunk list, future or None when stored, raw bytes) in write order
+        self.volumes = []
+        self.files = {}
+        self.current = None
+        self.offset = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.start_time = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(cancel_futures=True)
+            if self.current:
+                self.current.close()
+
+    def _next_volume(self):
+        if self.current:
+            self.current.close()
+        name = f"{os.path.basename(self.base_path)}.zpack.{len(self.volumes):03d}"
+        self.current = open(os.path.join(os.path.dirname(self.base_path), name), 'wb')
+        self.volumes.append(name)
+        self.offset = 0
+
+    def _write_oldest(self):
+        chunks, future, raw = self.pending.popleft()
+        data = future.result() if future else raw
+        compressed = future is not None and len(data) < len(raw)
+        if not compressed:
+            # Stored, or compression did not shrink it - keep the original bytes
+            data = raw
+
+        if self.current is None or self.offset + len(data) > self.volume_size:
+            self._next_volume()
+        self.current.write(data)
+        chunks.append([len(self.volumes) - 1, self.offset, len(data), len(raw), compressed])
+        self.offset += len(data)
+        self.stored_bytes += len(data)
+
+    def _queue(self, chunks, data, compress):
+        future = self.executor.submit(compress_chunk, self.codec, data) if compress else None
+        self.pending.append((chunks, future, data))
+        self.raw_bytes += len(data)
+        # Bounded in-flight window keeps memory fixed and the output streaming
+        while len(self.pending) > self.workers * 4:
+            self._write_oldest()
+
+    def add(self, src_path, rel_path, size, mtime, mode):
+        chunks = []
+        self.files[rel_path] = {'size': size, 'mtime': mtime, 'mode': mode, 'chunks': chunks}
+
+        with open(src_path, 'rb') as src:
+            data = src.read(self.chunk_size)
+            compress = is_compressible(src_path, data)
+            while data:
+                self._queue(chunks, data, compress)
+                data = src.read(self.chunk_size)
+
+    def close(self):
+        """Write out the remaining chunks and the index; returns the compression statistics"""
+        while self.pending:
+            self._write_oldest()
+        self.executor.shutdown()
+        if self.current:
+            self.current.close()
+            self.current = None
+
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'codec': self.codec, 'volumes': self.volumes, 'files': self.files}, f)
+        os.replace(tmp_path, self.index_path)
+        return self.stats()
+
+    def stats(self):
+        seconds = max(time.time() - self.start_time, 1e-6)
+        return {
+            'codec': self.codec,
+            'raw_bytes': self.raw_bytes,
+            'stored_bytes': self.stored_bytes,
+            'ratio': self.raw_bytes / self.stored_bytes if self.stored_bytes else 1.0,
+            'workers': self.workers,
+            'seconds': seconds,
+            'mb_per_s_per_core': self.raw_bytes / seconds / self.workers / (1024 * 1024)
+        }
+
+####################### ===== CompressedPackReader ===== #######################
+class CompressedPackReader:
+    """Reads files back from a CompressedPackWriter archive"""
+    def __init__(self, index_path):
+        self.directory = os.path.dirname(index_path)
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        self.codec = index['codec']
+        self.volumes = index['volumes']
+        self.files = index['files']
+
+    def list_files(self):
+        return list(self.files)
+
+    def extract(self, rel_path, dst_path):
+        info = self.files[rel_path]
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        with open(dst_path, 'wb') as dst:
+            for volume, offset, length, _, compressed in info['chunks']:
+                with open(os.path.join(self.directory, self.volumes[volume]), 'rb') as f:
+                    f.seek(offset)
+                    data = f.read(length)
+                dst.write(decompress_chunk(self.codec, data) if compressed else data)
+        os.chmod(dst_path, info['mode'] & 0o7777)
+        os.utime(dst_path, (info['mtime'], info['mtime']))
+        return dst_path
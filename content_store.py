@@ -0,0 +1,155 @@
+import os
+import json
+import uuid
+from fastcopy import copy_file
+from verify import hash_file, new_hasher
+from pack_archive import PackReader
+from compression import CompressedPackReader
+
+STORE_DIR = "USB_Backup_Store"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+####################### ===== ContentStore ===== #######################
+class ContentStore:
+    """Content-addressed backup store on a target device.
+
+    File contents are kept once under objects/<2 hex>/<hash>, and every snapshot is a
+    JSON manifest in snapshots/ mapping relative paths to blobs. Only plain files and
+    renames are used, so the layout works on FAT/exFAT where hard links are unavailable.
+    """
+    def __init__(self, target):
+        self.root = os.path.join(target, STORE_DIR)
+        self.objects_dir = os.path.join(self.root, 'objects')
+        self.snapshots_dir = os.path.join(self.root, 'snapshots')
+
+    def blob_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def has_blob(self, digest):
+        return os.path.exists(self.blob_path(digest))
+
+    def put_file(self, src_path, digest=None, chunk_size=HASH_CHUNK_SIZE):
+        """Store the content of src_path; returns (digest, True if a new blob was written).
+
+        The source is hashed first (unless its digest is passed in), so content the store
+        already holds costs a read of the source and no write to the target. New content
+        is hashed again while it streams into a temporary blob and stored under that
+        digest, which stays correct if the file changed in between.
+        """
+        if digest is None:
+            digest = hash_file(src_path, 'sha256', chunk_size)
+        if self.has_blob(digest):
+            return digest, False
+
+        os.makedirs(self.objects_dir, exist_ok=True)
+        # Unique, so parallel backups into the same store never share a temporary file
+        tmp_path = os.path.join(self.objects_dir, f"{uuid.uuid4().hex}.tmp")
+        hasher = new_hasher('sha256')
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        try:
+            with open(src_path, 'rb', buffering=0) as src, open(tmp_path, 'wb', buffering=0) as dst:
+                while True:
+                    read = src.readinto(buffer)
+                    if not read:
+                        break
+                    hasher.update(view[:read])
+                    written = 0
+                    while written < read:
+                        written += dst.write(view[written:read])
+            digest = hasher.hexdigest()
+            blob_path = self.blob_path(digest)
+            if os.path.exists(blob_path):
+                os.remove(tmp_path)
+                return digest, False
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            # A half-written blob never appears under its final name
+            os.replace(tmp_path, blob_path)
+            return digest, True
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def save_snapshot(self, name, files):
+        """Write the snapshot manifest {rel_path: {'hash', 'size', 'mtime'}} and return its path.
+
+        The file name is name plus a random suffix and is created exclusively, so two
+        snapshots taken within the same second never replace each other.
+        """
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        while True:
+            snapshot_path = os.path.join(self.snapshots_dir, f"{name}_{uuid.uuid4().hex[:12]}.json")
+            try:
+                f = open(snapshot_path, 'x')
+            except FileExistsError:
+                continue
+            with f:
+                json.dump(files, f)
+                f.flush()
+                os.fsync(f.fileno())
+            return snapshot_path
+
+    @staticmethod
+    def load_snapshot(snapshot_path):
+        with open(snapshot_path, 'r') as f:
+            return json.load(f)
+
+    def materialize(self, snapshot_path, destination, paths=None):
+        """Rebuild a snapshot (or only the given relative paths) under destination"""
+        files = self.load_snapshot(snapshot_path)
+        restored = []
+        for rel_path in (paths if paths is not None else files):
+            info = files[rel_path]
+            dst_path = os.path.join(destination, rel_path)
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            copy_file(self.blob_path(info['hash']), dst_path, copy_metadata=False)
+            os.utime(dst_path, (info['mtime'], info['mtime']))
+            restored.append(dst_path)
+        return restored
+
+####################### ===== SnapshotReader ===== #######################
+class SnapshotReader:
+    """Lists and restores any backup recorded in the backup history.
+
+    Handles content-addressed snapshots ('mode': 'dedup'), packed and compressed
+    archives ('mode': 'packed' / 'compressed') and plain USB_Backup_<timestamp> folders.
+    """
+    def __init__(self, backup_info):
+        self.backup_info = backup_info
+        self.is_dedup = backup_info.get('mode') == 'dedup'
+        self.pack = None
+        if backup_info.get('archive_index'):
+            reader = CompressedPackReader if backup_info.get('mode') == 'compressed' else PackReader
+            self.pack = reader(backup_info['archive_index'])
+
+    def list_files(self):
+        """Relative paths of all files in the snapshot"""
+        if self.is_dedup:
+            return sorted(ContentStore.load_snapshot(self.backup_info['snapshot']))
+
+        location = self.backup_info['backup_location']
+        files = [os.path.relpath(path, location) for path in self.backup_info['backed_up_files']]
+        if self.pack:
+            files.extend(self.pack.list_files())
+        return files
+
+    def materialize(self, destination, paths=None):
+        """Restore the snapshot (or only the given relative paths) into destination"""
+        if self.is_dedup:
+            store = ContentStore(os.path.dirname(self.backup_info['backup_location']))
+            return store.materialize(self.backup_info['snapshot'], destination, paths)
+
+        location = self.backup_info['backup_location']
+        restored = []
+        for rel_path in (paths if paths is not None else self.list_files()):
+            dst_path = os.path.join(destination, rel_path)
+            if self.pack and rel_path in self.pack.files:
+                restored.append(self.pack.extract(rel_path, dst_path))
+                continue
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            copy_file(os.path.join(location, rel_path), dst_path)
+            restored.append(dst_path)
+        return restored
@@ -2,19 +2,34 @@ import os
 import time
 import shutil
 import threading
+from contextlib import nullcontext
 import tkinter as tk
 from tkinter import ttk
-from view import USBView
+from view import USBView, VirtualList
 from model import USBModel
+from fastcopy import copy_file
+from pack_archive import PackWriter, PACK_MAX_FILE_SIZE
+from progress import ProgressChannel, ProgressEstimator, TkProgressPump
+from verify import copy_verified, filesystem_type, new_hasher, resolve_algorithm, verify_copy
+from journal import CHECKPOINT_BYTES, TransferJournal, resume_copy
+from metrics import METRICS
 from datetime import datetime
 
+HISTORY_PAGE_SIZE = 200    # History rows inserted into the Treeview per page
+
 ####################### ===== USBController ===== #######################
 class USBController:
     def __init__(self, root):
         self.model = USBModel()
         self.view = USBView(root, self)
         self.last_sync_info = None
-        self.model.start_monitoring(self.view.update_device_lists)
+        self.devices = {}    # Current devices by mount point, kept up to date by the monitor
+        self.pack_small_files = False    # Stream small files into one indexed archive per backup
+        self.span_targets = False    # Split transfers across the targets instead of copying to each
+        
+        # Worker threads publish progress here; Tk redraws it at a fixed frame rate
+        self.progress = ProgressChannel()
+        self.progress_pump = TkProgressPump(root, self.progress, self.view.update_progress)
         self.view.log_message("System initialized with backup support")
         
         # First explanation
@@ -23,8 +38,8 @@ class USBController:
         # It takes 1 second to reach the end, but the device is not yet there
         root.after(1000, self.manual_refresh)
         
-        # Monitoring with optimized interval
-        self.model.start_monitoring(self.view.update_device_lists)
+        # Event-driven monitoring, started once
+        self.model.start_monitoring(self.on_devices_changed)
         
         # root.protocol("WM_DELETE_WINDOW", self.on_close)
         self.view.log_message("System initialized. Ready for transfers.")
@@ -32,9 +47,21 @@ class USBController:
     def manual_refresh(self):
         """Manual refresh of device list"""
         devices = self.model.get_usb_devices()
+        self.devices = {device['mountpoint']: device for device in devices}
         self.view.update_device_lists(devices)
         self.view.log_message("Manual refresh completed")
     
+    def on_devices_changed(self, added, removed):
+        """Monitor callback (runs on the monitor thread) - hand the diff over to Tk"""
+        self.progress.call_soon(self._apply_device_changes, added, removed)
+    
+    def _apply_device_changes(self, added, removed):
+        for device in removed:
+            self.devices.pop(device['mountpoint'], None)
+        for device in added:
+            self.devices[device['mountpoint']] = device
+        self.view.update_device_lists(list(self.devices.values()))
+    
     def start_transfer(self):
         """Start transfer from selected source to selected targets"""
         source = self.view.get_selected_source()
@@ -76,35 +103,39 @@ class USBController:
         transfer_thread.start()
 
     def _perform_transfer(self, source, targets):
-        def progress_callback(progress, message, remaining):
-            self.view.update_progress(progress, message, remaining)
-        
-        success_targets = self.model.transfer_data(
-            source, targets, progress_callback
-        )
+        if self.span_targets:
+            success_targets = self.model.span_data(source, targets, self.progress.reporter())
+            problems = (self.model.last_span_plan or {}).get('problems', [])
+        else:
+            success_targets = self.model.transfer_data(source, targets, self.progress.reporter())
+            problems = [check['problem'] for check in self.model.last_capacity if check['problem']]
+        for problem in problems:
+            self.progress.call_soon(self.view.log_message, f"Not transferred: {problem}")
         
         # Turn the UI back on
-        self.view.transfer_btn.config(state=tk.NORMAL)
-        self.view.refresh_btn.config(state=tk.NORMAL)
+        self.progress.call_soon(self.view.transfer_btn.config, state=tk.NORMAL)
+        self.progress.call_soon(self.view.refresh_btn.config, state=tk.NORMAL)
         
         # Showing results
         if success_targets:
-            target_info = [f"{label} ({os.path.join(target, os.path.basename(source))})"
-            for label, target in zip(success_targets, targets)]
+            # The model returns the labels (basenames) of the targets that got their data,
+            # often fewer than were selected
+            mountpoints = {os.path.basename(target): target for target in targets}
+            target_info = [f"{label} ({os.path.join(mountpoints.get(label, label), os.path.basename(source))})"
+                           for label in success_targets]
             targets_str = "\n".join(target_info)
-            self.view.log_message("Transfer completed to:\n" + targets_str)
-            self.view.show_notification(
-                "Transfer Complete",
-targets_str = "\n".join(target_info)
-)
+            self.progress.call_soon(self.view.log_message, "Transfer completed to:\n" + targets_str)
+            self.progress.call_soon(self.view.show_notification, "Transfer Complete", targets_str)
         else:
-            self.view.log_message("Transfer failed - check device accessibility")
-            self.view.show_notification(
+            self.progress.call_soon(self.view.log_message, "Transfer failed - check device accessibility")
+            self.progress.call_soon(
+                self.view.show_notification,
                 "Transfer Failed",
+                "\n".join(problems) if problems else
                 "No data was transferred. Check if devices are accessible and have enough space."
             )
         
-        self.view.update_progress(0, "Ready for next transfer", 0)
+        self.progress.publish(0, "Ready for next transfer", 0)
 
     def start_backup(self):
         source = self.view.get_selected_source()
@@ -147,72 +178,157 @@ targets_str = "\n".join(target_info)
         )
         backup_thread.start()
 
+    @METRICS.job_function('gui_backup')
     def _perform_backup(self, source_device, target_devices):
+        journal = None
         try:
             source_path = source_device['mountpoint']
             timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
             
             # Setting the initial status
-            self.view.update_progress(0, "Backup in progress...", 0, 'backup')
+            self.progress.publish(0, "Backup in progress...", 0, 'backup')
             
-            # Counting the total number of files
-            total_files = 0
-            for root, _, files in os.walk(source_path):
-                total_files += len(files)
+            # Scanning the source once for all targets
+            with METRICS.phase('scan'):
+                manifest = self.model.scan_source(source_path)
+            total_files = len(manifest)
+            if manifest.pruned['dirs'] or manifest.pruned['files']:
+                self.progress.call_soon(self.view.log_message,
+                                        f"Filters skipped {manifest.pruned['dirs']} folders and "
+                                        f"{manifest.pruned['files']} files")
             
             if total_files == 0:
-                self.view.update_progress(100, "Backup complete: 0 files", 0, 'backup')
-                self.view.log_message("No files found for backup")
+                self.progress.publish(100, "Backup complete: 0 files", 0, 'backup')
+                self.progress.call_soon(self.view.log_message, "No files found for backup")
                 return
                 
             for target in target_devices:
                 target_path = target['mountpoint']
                 backup_dir = os.path.join(target_path, f"backup_{timestamp}")
                 
+                # An interrupted backup of the same source is continued in its own folder
+                journal = TransferJournal(target_path, f"backup|{os.path.abspath(source_path)}")
+                unfinished = journal.meta.get('backup_dir')
+                if unfinished and os.path.isdir(os.path.join(target_path, unfinished)):
+                    backup_dir = os.path.join(target_path, unfinished)
+                    self.progress.call_soon(self.view.log_message,
+                                            f"Resuming interrupted backup {unfinished} on {target['label']}")
+                else:
+                    journal.set_meta('backup_dir', os.path.basename(backup_dir))
+                
                 if not os.path.exists(backup_dir):
                     os.makedirs(backup_dir)
                 
                 copied_files = 0
-                start_time = time.time()
+                copied_bytes = 0
+                copy_methods = {}
+                estimator = ProgressEstimator(total_files, manifest.total_bytes, [target_path])
+                estimator.start(target_path)
                 
-                for root, dirs, files in os.walk(source_path):
-                    for file in files:
-                        src_file = os.path.join(root, file)
-                        rel_path = os.path.relpath(src_file, source_path)
-                        dst_file = os.path.join(backup_dir, rel_path)
+                created_dirs = set()
+                algorithm = resolve_algorithm(self.model.backup_manager.verify)
+                fstype = filesystem_type(target_path) if algorithm else ''
+                # The archive index is written when the block completes; on an error the volume is still closed
+                with (PackWriter(os.path.join(backup_dir, "files")) if self.pack_small_files
+                      else nullcontext()) as pack:
+                    for entry in manifest:
+                        if pack and entry.size <= PACK_MAX_FILE_SIZE:
+                            pack.add(manifest.source_path(entry), entry.rel_path,
+                                     entry.size, entry.mtime, entry.mode)
+                            copy_methods['packed'] = copy_methods.get('packed', 0) + 1
+                            copied_files += 1
+                            copied_bytes += entry.size
+                            estimator.file_done(target_path, entry.size)
+                        else:
+                            dst_file = os.path.join(backup_dir, entry.rel_path)
                         
-                        os.makedirs(os.path.dirname(dst_file), exist_ok=True)
-                        shutil.copy2(src_file, dst_file)
-                        copied_files += 1
-                        
-                        progress = (copied_files / total_files) * 100
-                        elapsed = time.time() - start_time
-                        remaining = (elapsed / max(1, progress)) * (100 - progress) if progress > 0 else 0
+                            dst_parent = os.path.dirname(dst_file)
+                            if dst_parent not in created_dirs:
+                                with METRICS.phase('makedirs'):
+                                    os.makedirs(dst_parent, exist_ok=True)
+                                created_dirs.add(dst_parent)
+                            src_file = manifest.source_path(entry)
+                            copy_start = time.perf_counter()
+                            offset = journal.resume_offset(entry.rel_path, entry.size, entry.mtime, dst_file)
+                            if offset >= entry.size and entry.size:
+                                method = 'resumed'
+                            elif offset or entry.size >= CHECKPOINT_BYTES:
+                                # Large files are checkpointed so an unplug loses at most one interval;
+                                # with verify on they are hashed on the way and checked like the others
+                                hasher = new_hasher(algorithm) if algorithm else None
+                                resume_copy(src_file, dst_file, offset, lambda position, entry=entry:
+                                            journal.checkpoint(entry.rel_path, entry.size, entry.mtime, position),
+                                            hasher=hasher)
+                                shutil.copystat(src_file, dst_file)
+                                if algorithm:
+                                    method = verify_copy(dst_file, hasher.hexdigest(), algorithm, fstype)
+                                else:
+                                    method = 'checkpointed'
+                            elif algorithm:
+                                _, method = copy_verified(src_file, dst_file, algorithm, fstype)
+                            else:
+                                method = copy_file(src_file, dst_file)
+                            if method != 'resumed':
+                                METRICS.record('copy_file', time.perf_counter() - copy_start, histogram=True)
+                                journal.mark_done(entry.rel_path, entry.size, entry.mtime, dst_file)
+                            copy_methods[method] = copy_methods.get(method, 0) + 1
+                            copied_files += 1
+                            copied_bytes += entry.size
+                            estimator.file_done(target_path, entry.size, entry.size - offset,
+                                                skipped=method == 'resumed')
+                        METRICS.count(target_path, 1, entry.size)
+                    
+                        progress, remaining, _, _ = estimator.snapshot()
                         status_msg = f"Backup to {target['label']}: {copied_files}/{total_files} files"
-                        self.view.update_progress(progress, status_msg, remaining, 'backup')
+                        self.progress.publish(progress, status_msg, remaining, 'backup',
+                                              files=copied_files, nbytes=copied_bytes)
+                
+                journal.complete()
                 
-                self.view.log_message(f"Backup to {target['label']} completed")
+                methods_str = ", ".join(f"{method}: {count}" for method, count in copy_methods.items())
+                self.progress.call_soon(self.view.log_message,
+                                        f"Backup to {target['label']} completed ({methods_str})")
+                if journal.saved_bytes:
+                    self.progress.call_soon(self.view.log_message,
+                                            f"Resume saved {journal.saved_bytes / (1024 * 1024):.1f} MB "
+                                            f"of copying on {target['label']}")
+                journal = None
             
             # Setting the final status
-            self.view.update_progress(100, "Backup completed successfully", 0, 'backup')
-            self.view.show_notification("Success", "Backup completed successfully")
+            self.progress.publish(100, "Backup completed successfully", 0, 'backup')
+            self.progress.call_soon(self.view.show_notification, "Success", "Backup completed successfully")
             
         except Exception as e:
+            if journal:
+                # Keep what was confirmed so far for the next attempt
+                journal.close()
             error_msg = f"Backup failed: {str(e)}"
-            self.view.update_progress(0, error_msg, 0, 'backup')
-            self.view.log_message(error_msg)
-            self.view.show_notification("Error", error_msg)
+            METRICS.error(source_device['mountpoint'], e)
+            self.progress.publish(0, error_msg, 0, 'backup')
+            self.progress.call_soon(self.view.log_message, error_msg)
+            self.progress.call_soon(self.view.show_notification, "Error", error_msg)
         
         finally:
             # Restoring buttons
-            self.view.sync_btn.config(state=tk.NORMAL)
-            self.view.refresh_btn.config(state=tk.NORMAL)
-            self.view.backup_btn.config(state=tk.NORMAL)
+            self.progress.call_soon(self.view.sync_btn.config, state=tk.NORMAL)
+            self.progress.call_soon(self.view.refresh_btn.config, state=tk.NORMAL)
+            self.progress.call_soon(self.view.backup_btn.config, state=tk.NORMAL)
             
             # After 5 seconds we reset the status
-            self.view.root.after(5000, lambda: self.view.update_progress(
+            self.progress.call_soon(self.view.root.after, 5000, lambda: self.progress.publish(
                 0, "Backup progress: not started", 0, 'backup'))
 
+    def reset_sync_index(self):
+        """Forget what the selected targets are known to hold; the next sync checks every file"""
+        targets = self.view.get_selected_targets()
+        if not targets:
+            self.view.show_notification("Error", "No target devices selected")
+            return
+        for device in self.model.get_usb_devices():
+            if device['label'] in targets:
+                self.model.invalidate_index(device['mountpoint'])
+                self.view.log_message(f"Sync index of {device['label']} reset")
+    
     def start_sync_with_backup(self):
         source = self.view.get_selected_source()
         targets = self.view.get_selected_targets()
@@ -250,31 +366,30 @@ targets_str = "\n".join(target_info)
         sync_thread.start()
 
     def _perform_sync_with_backup(self, source, targets):
-        def progress_callback(progress, message, remaining):
-            self.view.update_progress(progress, message, remaining)
-        
         self.last_sync_info = self.model.sync_with_backup(
-            source, targets, progress_callback
+            source, targets, self.progress.reporter()
         )
         
-        self.view.sync_btn.config(state=tk.NORMAL)
-        self.view.refresh_btn.config(state=tk.NORMAL)
+        self.progress.call_soon(self.view.sync_btn.config, state=tk.NORMAL)
+        self.progress.call_soon(self.view.refresh_btn.config, state=tk.NORMAL)
 
         if self.last_sync_info:
             targets_str = ", ".join([info['target'] for info in self.last_sync_info])
-            self.view.log_message(f"Sync with backup completed to: {targets_str}")
-            self.view.show_notification(
+            self.progress.call_soon(self.view.log_message, f"Sync with backup completed to: {targets_str}")
+            self.progress.call_soon(
+                self.view.show_notification,
                 "Sync Complete",
                 f"Data successfully synchronized to: {targets_str}\nBackups created on target devices."
             )
         else:
-            self.view.log_message("Sync failed - check device accessibility")
-            self.view.show_notification(
+            self.progress.call_soon(self.view.log_message, "Sync failed - check device accessibility")
+            self.progress.call_soon(
+                self.view.show_notification,
                 "Sync Failed",
                 "No data was synchronized. Check if devices are accessible."
             )
         
-        self.view.update_progress(0, "Ready for next operation", 0)
+        self.progress.publish(0, "Ready for next operation", 0)
     
     def show_backup_history(self):
         history = self.model.backup_manager.backup_history
@@ -286,7 +401,21 @@ targets_str = "\n".join(target_info)
         history_window.title("Backup History")
         history_window.geometry("800x500")
         
-        tree = ttk.Treeview(history_window, columns=('source', 'backup_location', 'timestamp'))
+        # Search for snapshots that contain a path
+        search_frame = ttk.Frame(history_window)
+        search_frame.pack(fill=tk.X, padx=5, pady=5)
+        search_var = tk.StringVar()
+        search_entry = ttk.Entry(search_frame, textvariable=search_var)
+        search_entry.pack(side="left", fill=tk.X, expand=True, padx=(0, 5))
+        search_btn = ttk.Button(search_frame, text="Find Path")
+        search_btn.pack(side="left", padx=(0, 5))
+        clear_btn = ttk.Button(search_frame, text="Show All")
+        clear_btn.pack(side="left")
+        
+        tree_frame = ttk.Frame(history_window)
+        tree_frame.pack(fill=tk.BOTH, expand=True)
+        
+        tree = ttk.Treeview(tree_frame, columns=('source', 'backup_location', 'timestamp'))
         tree.heading('#0', text='#')
         tree.heading('source', text='Source')
         tree.heading('backup_location', text='Backup Location')
@@ -297,34 +426,84 @@ targets_str = "\n".join(target_info)
         tree.column('backup_location', width=300)
         tree.column('timestamp', width=150)
         
-        for i, backup in enumerate(reversed(history), 1):
-            tree.insert('', 'end', text=str(i), 
-                      values=(backup['source'], backup['backup_location'], backup['timestamp']))
-        
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=tree.yview)
+        scrollbar.pack(side="right", fill="y")
         tree.pack(fill=tk.BOTH, expand=True)
+        
+        # Entries are inserted a page at a time as the user scrolls towards the end
+        shown = {'rows': list(range(len(history) - 1, -1, -1)), 'loaded': 0}
+        
+        def load_page():
+            rows = shown['rows'][shown['loaded']:shown['loaded'] + HISTORY_PAGE_SIZE]
+            for index in rows:
+                backup = history[index]
+                tree.insert('', 'end', iid=str(index), text=str(len(history) - index),
+                            values=(backup['source'], backup['backup_location'], backup['timestamp']))
+            shown['loaded'] += len(rows)
+        
+        def on_tree_scroll(first, last):
+            scrollbar.set(first, last)
+            if float(last) > 0.9 and shown['loaded'] < len(shown['rows']):
+                load_page()
+        
+        def show_rows(rows):
+            tree.delete(*tree.get_children())
+            shown['rows'] = rows
+            shown['loaded'] = 0
+            load_page()
+        
+        tree.configure(yscrollcommand=on_tree_scroll)
+        load_page()
+        
+        def search():
+            text = search_var.get().strip()
+            if not text:
+                show_rows(list(range(len(history) - 1, -1, -1)))
+                return
+            search_btn.config(state=tk.DISABLED)
+            
+            def worker():
+                # The first search may have to index older snapshots - keep Tk responsive
+                ids = self.model.backup_manager.store.search(history, text)
+                positions = {backup.get('id'): index for index, backup in enumerate(history)}
+                rows = sorted((positions[record_id] for record_id in ids if record_id in positions), reverse=True)
+                
+                def apply():
+                    show_rows(rows)
+                    search_btn.config(state=tk.NORMAL)
+                    self.view.log_message(f"{len(rows)} snapshots contain '{text}'")
+                self.progress.call_soon(apply)
+            
+            threading.Thread(target=worker, daemon=True).start()
+        
+        search_btn.config(command=search)
+        clear_btn.config(command=lambda: (search_var.set(""), search()))
+        search_entry.bind("<Return>", lambda event: search())
 
         def on_select(event):
             selected_item = tree.focus()
             if selected_item:
                 item_data = tree.item(selected_item)
-                backup_info = history[len(history) - int(item_data['text'])]
+                backup_info = history[int(selected_item)]
                 
                 detail_window = tk.Toplevel(history_window)
                 detail_window.title(f"Backup Details #{item_data['text']}")
+                detail_window.geometry("700x500")
                 
-                text = tk.Text(detail_window, wrap=tk.WORD)
-                text.pack(fill=tk.BOTH, expand=True)
-                
-                text.insert(tk.END, f"Timestamp: {backup_info['timestamp']}\n")
-                text.insert(tk.END, f"Source: {backup_info['source']}\n")
-                text.insert(tk.END, f"Backup Location: {backup_info['backup_location']}\n")
-                text.insert(tk.END, f"\nFiles backed up ({backup_info['original_files_count']}):\n\n")
-                
-                for file in backup_info['backed_up_files'][:50]:
-                    text.insert(tk.END, f"{file}\n")
+                header = (f"Timestamp: {backup_info['timestamp']}\n"
+                          f"Source: {backup_info['source']}\n"
+                          f"Backup Location: {backup_info['backup_location']}\n"
+                          f"Files backed up ({backup_info['original_files_count']}):")
+                ttk.Label(detail_window, text=header, justify="left").pack(fill=tk.X, padx=5, pady=5)
                 
-                if len(backup_info['backed_up_files']) > 50:
-                    text.insert(tk.END, f"\n...and {len(backup_info['backed_up_files']) - 50} more files")
+                # Complete file list, rendered a screenful at a time
+                try:
+                    files = self.model.backup_manager.list_snapshot(backup_info)
+                except Exception as e:
+                    files = [f"Cannot read file list: {e}"]
+                file_list = VirtualList(detail_window)
+                file_list.pack(fill=tk.BOTH, expand=True)
+                file_list.set_rows(files)
         
         tree.bind('<<TreeviewSelect>>', on_select)
     
@@ -0,0 +1,327 @@
+import os
+import queue
+import shutil
+import time
+import threading
+from verify import new_hasher, verify_copy
+from journal import CHECKPOINT_BYTES
+from metrics import METRICS
+
+CHUNK_SIZE = 4 * 1024 * 1024    # Size of one read from the source
+POOL_BUFFERS = 8                # Preallocated read buffers; peak memory is POOL_BUFFERS * CHUNK_SIZE
+MAX_PENDING_CHUNKS = 16         # Queued operations a slow target may lag behind the reader
+
+####################### ===== BufferPool ===== #######################
+class BufferPool:
+    """Fixed set of preallocated read buffers shared by the reader and the writers.
+
+    acquire() blocks while every buffer is still being written somewhere, which is
+    what throttles the reader to the speed of the slowest target.
+    """
+    def __init__(self, count=POOL_BUFFERS, size=CHUNK_SIZE):
+        self.size = size
+        self.free = queue.Queue()
+        for _ in range(count):
+            self.free.put(bytearray(size))
+
+    def acquire(self):
+        return self.free.get()
+
+    def release(self, buffer):
+        self.free.put(buffer)
+
+class SharedChunk:
+    """A filled pool buffer handed to several writers; back to the pool after the last one"""
+    __slots__ = ('pool', 'buffer', 'view', 'offset', 'pending', 'lock')
+
+    def __init__(self, pool, buffer, length, writers, offset=0):
+        self.pool = pool
+        self.buffer = buffer
+        self.view = memoryview(buffer)[:length]
+        self.offset = offset    # Position of the chunk in its file
+        self.pending = writers
+        self.lock = threading.Lock()
+
+    def done(self):
+        with self.lock:
+            self.pending -= 1
+            last = self.pending == 0
+        if last:
+            self.view.release()
+            self.pool.release(self.buffer)
+
+####################### ===== TargetWriter ===== #######################
+class TargetWriter(threading.Thread):
+    """Writes the chunks queued by FanOutCopier to one or more target directories.
+
+    Targets that live on the same physical device share a writer, so they are
+    written one after another instead of competing for the same bus. With a hash
+    algorithm every finished file is read back and checked against the source digest.
+    Targets with a journal (see journal.TransferJournal) resume from the offset the
+    reader passes in, checkpoint large files as they grow and record finished files.
+    """
+    def __init__(self, targets, on_file_done, max_pending=MAX_PENDING_CHUNKS,
+                 hash_algorithm=None, fstypes=None, journals=None):
+        super().__init__(daemon=True)
+        self.targets = targets    # [(index, root), ...]
+        self.on_file_done = on_file_done
+        self.hash_algorithm = hash_algorithm
+        self.fstypes = fstypes or {}      # index -> filesystem type, decides whether to read back
+        self.journals = journals or {}    # index -> TransferJournal
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.errors = {index: 0 for index, _ in targets}
+        self.opened = None    # When the current file was opened, while metrics are on
+
+    def run(self):
+        files = {}
+        dst_paths = {}
+        errors = {}
+        written = {}
+        starts = {}
+        unsynced = {}
+        current = None
+
+        while True:
+            op, arg = self.queue.get()
+
+            if op == 'open':
+                current = arg    # (rel_path, size, mtime, {index: resume offset})
+                self.opened = time.perf_counter() if METRICS.enabled else None
+                rel_path, size, _, offsets = arg
+                for index, root in self.targets:
+                    dst_paths[index] = os.path.join(root, rel_path)
+                    files[index] = None
+                    errors[index] = None
+                    written[index] = 0
+                    unsynced[index] = 0
+                    starts[index] = offsets.get(index, 0)
+                    if size and starts[index] >= size:
+                        continue    # Already complete on this target
+                    try:
+                        os.makedirs(os.path.dirname(dst_paths[index]), exist_ok=True)
+                        if starts[index]:
+                            files[index] = open(dst_paths[index], 'r+b')
+                            files[index].truncate(starts[index])
+                            files[index].seek(starts[index])
+                        else:
+                            files[index] = open(dst_paths[index], 'wb')
+                    except Exception as e:
+                        errors[index] = e
+
+            elif op == 'data':
+                for index, _ in self.targets:
+                    if files[index] and not errors[index]:
+                        # Skip the part of the chunk that a resumed target already has
+                        skip = starts[index] - arg.offset
+                        if skip >= len(arg.view):
+                            continue
+                        try:
+                            data = arg.view[skip:] if skip > 0 else arg.view
+                            files[index].write(data)
+                            written[index] += len(data)
+                            unsynced[index] += len(data)
+                            journal = self.journals.get(index)
+                            if journal and unsynced[index] >= CHECKPOINT_BYTES:
+                                files[index].flush()
+                                os.fsync(files[index].fileno())
+                                journal.checkpoint(current[0], current[1], current[2],
+                                                   arg.offset + len(arg.view))
+                                unsynced[index] = 0
+                        except Exception as e:
+                            errors[index] = e
+                arg.done()
+
+            elif op in ('close', 'abort'):
+                for index, _ in self.targets:
+                    self._finish(op, arg, index, files, dst_paths, errors, written[index], current)
+                if self.opened is not None:
+                    # From open to close of one file on every target of this writer
+                    METRICS.record('write_file', time.perf_counter() - self.opened, histogram=True)
+
+            elif op == 'stop':
+                break
+
+    def _finish(self, op, arg, index, files, dst_paths, errors, nbytes, current):
+        dst_path = dst_paths[index]
+        error = errors[index]
+        skipped = files[index] is None and error is None
+
+        if files[index]:
+            try:
+                files[index].close()
+            except Exception as e:
+                error = error or e
+            files[index] = None
+
+        if op == 'abort':
+            error = error or arg
+            # The source could not be read completely - drop the partial copy,
+            # unless a journal keeps it for the next run to continue
+            if not skipped and index not in self.journals:
+                try:
+                    os.remove(dst_path)
+                except OSError:
+                    pass
+        elif not error and not skipped:
+            src_path, digest = arg
+            try:
+                shutil.copystat(src_path, dst_path)
+                if digest:
+                    verify_copy(dst_path, digest, self.hash_algorithm, self.fstypes.get(index, ''))
+                journal = self.journals.get(index)
+                if journal and current[1] is not None:
+                    journal.mark_done(current[0], current[1], current[2], dst_path)
+            except Exception as e:
+                error = e
+
+        if error:
+            self.errors[index] += 1
+        if self.on_file_done:
+            try:
+                self.on_file_done(index, dst_path, error, nbytes, current[1])
+            except Exception as e:
+                # A failing callback must not kill the writer - the reader would block forever
+                print(f"Progress callback failed: {e}")
+
+####################### ===== FanOutCopier ===== #######################
+class FanOutCopier:
+    """Reads every source file once and writes it to all target directories concurrently.
+
+    The calling thread is the reader: it fills buffers from a BufferPool and queues
+    them to the writer threads, so reading the next chunk overlaps with writing the
+    previous ones and memory stays fixed regardless of file size. The source is read
+    a single time and the job takes as long as the slowest target. on_file_done(index,
+    dst_path, error, nbytes_written, size) is called by the writer threads for every
+    file and target. `groups` lists the
+    target indices handled by each writer (see workers.group_by_device); by default
+    every target gets its own writer.
+
+    With hash_algorithm (see verify.resolve_algorithm) the reader hashes each file
+    while streaming it, the writers verify their copies against that digest and
+    checksums maps every copied rel_path to it.
+
+    journals gives a TransferJournal per target (or None); files passed to copy() with
+    their size and mtime are then skipped or continued where an earlier run stopped.
+    """
+    def __init__(self, target_dirs, on_file_done=None, groups=None,
+                 chunk_size=CHUNK_SIZE, pool_buffers=POOL_BUFFERS, max_pending=MAX_PENDING_CHUNKS,
+                 hash_algorithm=None, fstypes=None, journals=None):
+        self.pool = BufferPool(pool_buffers, chunk_size)
+        self.target_dirs = target_dirs
+        self.hash_algorithm = hash_algorithm
+        self.checksums = {}
+        self.target_errors = []
+        if groups is None:
+            groups = [[index] for index in range(len(target_dirs))]
+        fstypes = dict(enumerate(fstypes or []))
+        self.journals = {index: journal for index, journal in enumerate(journals or []) if journal}
+        self.writers = [TargetWriter([(index, target_dirs[index]) for index in group],
+                                     on_file_done, max_pending, hash_algorithm, fstypes,
+                                     {index: self.journals[index] for index in group if index in self.journals})
+                        for group in groups if group]
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        for writer in self.writers:
+            writer.start()
+
+    def _broadcast(self, op, arg):
+        for writer in self.writers:
+            writer.queue.put((op, arg))
+
+    def copy(self, src_path, rel_path, size=None, mtime=None):
+        """Queue one source file for all targets; rel_path is relative to each target dir.
+
+        With size and mtime given, targets whose journal confirms (part of) the file
+        only receive what they are missing.
+        """
+        offsets = {}
+        if size is not None:
+            for index, journal in self.journals.items():
+                offsets[index] = journal.resume_offset(rel_path, size, mtime,
+                                                       os.path.join(self.target_dirs[index], rel_path))
+        start = min(offsets.get(index, 0) for index in range(len(self.target_dirs)))
+        if size and start >= size:
+            # Complete everywhere - the writers only report it
+            self._broadcast('open', (rel_path, size, mtime, offsets))
+            self._broadcast('close', (src_path, None))
+            return True
+
+        try:
+            src_file = open(src_path, 'rb', buffering=0)
+        except Exception as e:
+            print(f"Error reading {src_path}: {e}")
+            # Every target records the failure, as for a read error further in
+            self._broadcast('open', (rel_path, size, mtime, offsets))
+            self._broadcast('abort', e)
+            return False
+
+        hasher = new_hasher(self.hash_algorithm) if self.hash_algorithm else None
+        self._broadcast('open', (rel_path, size, mtime, offsets))
+        try:
+            with src_file:
+                if start and hasher:
+                    # The digest covers the whole file, including the part that is not copied again
+                    self._hash_prefix(src_file, hasher, start)
+                src_file.seek(start)
+                position = start
+                while True:
+                    # Blocks while all buffers are in flight (backpressure from the writers)
+                    buffer = self.pool.acquire()
+                    try:
+                        length = src_file.readinto(buffer)
+                    except Exception:
+                        self.pool.release(buffer)
+                        raise
+                    if not length:
+                        self.pool.release(buffer)
+                        break
+                    chunk = SharedChunk(self.pool, buffer, length, len(self.writers), position)
+                    position += length
+                    if hasher:
+                        hasher.update(chunk.view)
+                    # The same buffer is shared by every writer, never copied
+                    self._broadcast('data', chunk)
+        except Exception as e:
+            print(f"Error reading {src_path}: {e}")
+            self._broadcast('abort', e)
+            return False
+
+        digest = hasher.hexdigest() if hasher else None
+        if digest:
+            self.checksums[rel_path] = digest
+        self._broadcast('close', (src_path, digest))
+        return True
+
+    def _hash_prefix(self, src_file, hasher, length):
+        buffer = self.pool.acquire()
+        try:
+            view = memoryview(buffer)
+            remaining = length
+            while remaining > 0:
+                read = src_file.readinto(view[:min(remaining, len(buffer))])
+                if not read:
+                    break
+                hasher.update(view[:read])
+                remaining -= read
+            view.release()
+        finally:
+            self.pool.release(buffer)
+
+    def close(self):
+        """Wait until every target has written all queued files, return error counts per target"""
+        self._broadcast('stop', None)
+        errors = {}
+        for writer in self.writers:
+            writer.join()
+            errors.update(writer.errors)
+        for journal in self.journals.values():
+            journal.flush()
+        self.target_errors = [errors[index] for index in sorted(errors)]
+        return self.target_errors
@@ -0,0 +1,61 @@
+import os
+import shutil
+from fastcopy import copy_file
+from verify import hash_copy, new_hasher
+
+DELTA_MIN_SIZE = 64 * 1024 * 1024    # Files below this size are simply copied again
+DELTA_BLOCK_SIZE = 1024 * 1024
+
+def delta_copy(src_path, dst_path, block_size=DELTA_BLOCK_SIZE, hasher=None):
+    """Update dst_path in place so it equals src_path, writing only the blocks that differ.
+
+    Both files are read block by block at the same offsets; unchanged blocks are left
+    alone and the destination is truncated or extended to the source size. The source
+    blocks are fed to hasher if given. Returns (bytes_written, bytes_total).
+    """
+    bytes_written = 0
+    bytes_total = 0
+
+    with open(src_path, 'rb') as src, open(dst_path, 'r+b') as dst:
+        offset = 0
+        while True:
+            src_block = src.read(block_size)
+            if not src_block:
+                break
+            if hasher:
+                hasher.update(src_block)
+
+            dst.seek(offset)
+            dst_block = dst.read(len(src_block))
+            if dst_block != src_block:
+                dst.seek(offset)
+                dst.write(src_block)
+                bytes_written += len(src_block)
+
+            offset += len(src_block)
+            bytes_total += len(src_block)
+
+        dst.truncate(offset)
+
+    shutil.copystat(src_path, dst_path)
+    return bytes_written, bytes_total
+
+def sync_file(src_path, dst_path, size, min_size=DELTA_MIN_SIZE, block_size=DELTA_BLOCK_SIZE,
+              algorithm=None):
+    """Copy src_path over dst_path, using an in-place delta for large existing files.
+
+    Returns (bytes_written, method, digest) where method is 'delta' or the copy_file
+    method. With a hash algorithm the source is hashed while it is read and digest
+    is its checksum, otherwise None.
+    """
+    if min_size is not None and size >= min_size and os.path.isfile(dst_path):
+        hasher = new_hasher(algorithm) if algorithm else None
+        try:
+            bytes_written = delta_copy(src_path, dst_path, block_size, hasher)[0]
+            return bytes_written, 'delta', hasher.hexdigest() if hasher else None
+        except OSError as e:
+            print(f"Delta update of {dst_path} failed, copying whole file: {e}")
+
+    if algorithm:
+        return size, 'buffered', hash_copy(src_path, dst_path, algorithm)
+    return size, copy_file(src_path, dst_path), None
@@ -0,0 +1,109 @@
+import os
+import errno
+import shutil
+
+BUFFER_SIZE = 1024 * 1024    # Buffer of the user-space fallback
+FICLONE = 0x40049409         # Linux ioctl that shares extents (btrfs, xfs, ...)
+
+# Errors meaning "this kernel/filesystem can't do it", after which the next method is tried
+FALLBACK_ERRNOS = {errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP,
+                    errno.ENOTSUP, errno.EBADF, errno.ENOTTY, errno.EPERM}
+_unsupported = set()    # (method, source device, target device) that failed this way, not tried again
+
+class _ShortCopy(Exception):
+    """A kernel copy returned 0 before the source size was reached"""
+    def __init__(self, copied):
+        super().__init__(f"copy ended after {copied} bytes")
+        self.copied = copied
+
+def _reflink(src_fd, dst_fd, size):
+    import fcntl
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+def _copy_file_range(src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(src_fd, dst_fd, size - copied)
+        if sent == 0:
+            raise _ShortCopy(copied)
+        copied += sent
+
+def _sendfile(src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(dst_fd, src_fd, copied, size - copied)
+        if sent == 0:
+            raise _ShortCopy(copied)
+        copied += sent
+
+def _buffered(src_fd, dst_fd, size, buffer_size=BUFFER_SIZE):
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(src_fd, 'rb', buffering=0, closefd=False) as src, \
+            open(dst_fd, 'wb', buffering=0, closefd=False) as dst:
+        while True:
+            read = src.readinto(buffer)
+            if not read:
+                break
+            written = 0
+            while written < read:
+                written += dst.write(view[written:read])
+
+def _methods(same_device):
+    methods = []
+    if same_device and os.name == 'posix':
+        methods.append(('reflink', _reflink))
+    if hasattr(os, 'copy_file_range'):
+        methods.append(('copy_file_range', _copy_file_range))
+    if hasattr(os, 'sendfile'):
+        methods.append(('sendfile', _sendfile))
+    return methods
+
+def copy_file(src_path, dst_path, copy_metadata=True):
+    """Copy a file through the cheapest kernel path available and return the method used.
+
+    Tries a reflink when both files share a filesystem, then copy_file_range, then
+    sendfile, and only then a buffered user-space copy. A kernel copy that ends before
+    the source size falls back like an unsupported one, and files that report size 0
+    (procfs and the like may still have content) are always read. With copy_metadata
+    the timestamps and mode are copied as well, like shutil.copy2.
+    """
+    binary = getattr(os, 'O_BINARY', 0)
+    src_fd = os.open(src_path, os.O_RDONLY | binary)
+    try:
+        src_stat = os.fstat(src_fd)
+        dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | binary, 0o666)
+        try:
+            dst_device = os.fstat(dst_fd).st_dev
+            method = 'buffered'
+            for name, func in (_methods(dst_device == src_stat.st_dev) if src_stat.st_size else []):
+                # Support depends on the kernel and on both filesystems (EXDEV across some pairs),
+                # so a failure only rules the method out for this pair of devices
+                key = (name, src_stat.st_dev, dst_device)
+                if key in _unsupported:
+                    continue
+                try:
+                    func(src_fd, dst_fd, src_stat.st_size)
+                    method = name
+                    break
+                except (OSError, _ShortCopy) as e:
+                    if isinstance(e, OSError) and e.errno not in FALLBACK_ERRNOS:
+                        raise
+                    # Nothing copied at all means the method does not work here; a copy cut
+                    # short midway (e.g. a shrinking source) only retries this file
+                    if isinstance(e, OSError) or not e.copied:
+                        _unsupported.add(key)
+                    # Start over with the next method on an empty destination
+                    os.lseek(src_fd, 0, os.SEEK_SET)
+                    os.lseek(dst_fd, 0, os.SEEK_SET)
+                    os.ftruncate(dst_fd, 0)
+            else:
+                _buffered(src_fd, dst_fd, src_stat.st_size)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+    if copy_metadata:
+        shutil.copystat(src_path, dst_path)
+    return method
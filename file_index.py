@@ -0,0 +1,103 @@
+import os
+import glob
+import shutil
+import sqlite3
+import hashlib
+
+INDEX_DIR = "sync_index"
+
+def device_identity(mountpoint):
+    """Stable identity of the volume mounted at mountpoint (UUID or serial where available)"""
+    identity = None
+    if os.name == 'nt':
+        try:
+            import ctypes
+            serial = ctypes.c_uint32()
+            if ctypes.windll.kernel32.GetVolumeInformationW(
+                    ctypes.c_wchar_p(os.path.splitdrive(mountpoint)[0] + '\\'),
+                    None, 0, ctypes.byref(serial), None, None, None, 0):
+                identity = f"serial-{serial.value:08X}"
+        except Exception:
+            pass
+    else:
+        try:
+            import psutil
+            devices = {os.path.normpath(p.mountpoint): os.path.realpath(p.device)
+                       for p in psutil.disk_partitions(all=True)}
+            device = devices.get(os.path.normpath(mountpoint))
+            for link in glob.glob('/dev/disk/by-uuid/*'):
+                if device and os.path.realpath(link) == device:
+                    identity = f"uuid-{os.path.basename(link)}"
+                    break
+        except Exception:
+            pass
+
+    if identity is None:
+        # No volume id available - fall back to the mount point and its capacity
+        total = shutil.disk_usage(mountpoint).total
+        identity = f"mount-{os.path.normpath(mountpoint)}-{total}"
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()[:16]
+
+def device_stamp(mountpoint):
+    """Cheap fingerprint of a device's state: its used bytes.
+
+    It catches files added, removed or resized outside the tool, but not an edit that
+    leaves the used space unchanged (same size, or a change within a partly used
+    cluster). Such edits stay invisible to indexed syncs until the index is reset
+    (USBModel.invalidate_index, 'cli.py sync --reindex', or File > Reset Sync Index).
+    """
+    return str(shutil.disk_usage(mountpoint).used)
+
+####################### ===== FileIndex ===== #######################
+class FileIndex:
+    """Persistent SQLite index of the last synced state of one device.
+
+    Rows hold (root, rel_path, size, mtime, hash) of the source files that are known
+    to be identical on the device, so an unchanged tree can be confirmed by scanning
+    only the source. The device stamp saved after each sync detects writes made
+    outside the tool; invalidate() drops the index explicitly.
+    """
+    def __init__(self, identity, index_dir=INDEX_DIR):
+        os.makedirs(index_dir, exist_ok=True)
+        self.path = os.path.join(index_dir, f"{identity}.sqlite")
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS files (
+                               root TEXT, rel_path TEXT, size INTEGER, mtime REAL, hash TEXT,
+                               PRIMARY KEY (root, rel_path)) WITHOUT ROWID""")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def load(self, root):
+        """{rel_path: (size, mtime, hash)} of everything last synced into root"""
+        rows = self.db.execute("SELECT rel_path, size, mtime, hash FROM files WHERE root = ?", (root,))
+        return {rel_path: (size, mtime, digest) for rel_path, size, mtime, digest in rows}
+
+    def replace(self, root, entries):
+        """Store the synced state of root; entries are (rel_path, size, mtime, hash) tuples"""
+        with self.db:
+            self.db.execute("DELETE FROM files WHERE root = ?", (root,))
+            self.db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                                ((root,) + tuple(entry) for entry in entries))
+
+    def get_stamp(self):
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'stamp'").fetchone()
+        return row[0] if row else None
+
+    def set_stamp(self, stamp):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('stamp', ?)", (stamp,))
+
+    def invalidate(self):
+        """Forget everything; the next sync falls back to comparing against the device"""
+        with self.db:
+            self.db.execute("DELETE FROM files")
+            self.db.execute("DELETE FROM meta")
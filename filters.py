@@ -0,0 +1,134 @@
+import os
+import re
+
+IGNORE_FILE = ".usb_sync_ignore"    # Rules kept on a source device for every job that reads it
+
+# Operating system clutter, build caches and this tool's own bookkeeping
+DEFAULT_EXCLUDES = (
+    'System Volume Information/',
+    '$RECYCLE.BIN/',
+    'RECYCLER/',
+    '.Trashes/',
+    '.Trash-*/',
+    '.Spotlight-V100/',
+    '.fseventsd/',
+    '.TemporaryItems/',
+    '.DS_Store',
+    'Thumbs.db',
+    '__pycache__/',
+    '.pytest_cache/',
+    '.mypy_cache/',
+    '.gradle/',
+    '.usb_sync_journal/',
+)
+
+def _translate(pattern):
+    """Regex for one gitignore-style glob, matched against the whole '/'-separated relative path"""
+    anchored = pattern.startswith('/') or '/' in pattern
+    pattern = pattern.lstrip('/')
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            out.append('/.*')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif pattern[i] == '[' and pattern.find(']', i + 2) != -1:
+            end = pattern.find(']', i + 2)
+            content = pattern[i + 1:end]
+            if content.startswith('!'):
+                content = '^' + content[1:]
+            out.append('[' + content.replace('\\', '\\\\') + ']')
+            i = end + 1
+        elif pattern[i] == '\\' and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return ('' if anchored else '(?:.*/)?') + ''.join(out)
+
+def parse_rule(line):
+    """(negate, dir_only, regex) for one rule line, None for blank lines and comments.
+
+    Globs follow .gitignore: a trailing '/' matches directories only, a pattern with a
+    '/' is anchored at the source root, '**' spans directories and a leading '!'
+    re-includes. 're:<regex>' is searched in the relative path instead.
+    """
+    line = line.rstrip('\n').rstrip('\r')
+    if not line.strip() or line.startswith('#'):
+        return None
+    negate = line.startswith('!')
+    if negate or line.startswith('\\!') or line.startswith('\\#'):
+        line = line[1:]
+    if line.startswith('re:'):
+        return negate, False, '.*?(?:' + line[3:] + ').*'
+    line = line.rstrip()
+    dir_only = line.endswith('/')
+    return negate, dir_only, _translate(line.rstrip('/'))
+
+def load_rules(path):
+    """Rule lines of a filter file, [] when there is none"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+####################### ===== PathFilter ===== #######################
+class PathFilter:
+    """Include/exclude rules compiled once into a few combined regular expressions.
+
+    The last matching rule decides, as in .gitignore. Neighbouring rules with the same
+    sign and kind are merged into one alternation, so checking a path costs a handful
+    of regex calls however many rules there are. Scanners ask excluded() for every
+    directory before entering it: an excluded directory is pruned with everything
+    below it, which is also why a '!' rule cannot re-include a file inside one.
+    """
+    def __init__(self, rules=(), ignore_case=None):
+        if ignore_case is None:
+            ignore_case = os.name == 'nt'
+        flags = re.IGNORECASE if ignore_case else 0
+        parsed = [rule for rule in (parse_rule(line) for line in rules) if rule]
+        self.rules = len(parsed)
+
+        self.groups = []    # (negate, dir_only, compiled alternation), in rule order
+        for negate, dir_only, regex in parsed:
+            if self.groups and self.groups[-1][:2] == (negate, dir_only):
+                self.groups[-1][2].append(regex)
+            else:
+                self.groups.append((negate, dir_only, [regex]))
+        self.groups = [(negate, dir_only, re.compile('|'.join(f"(?:{regex})" for regex in regexes), flags))
+                       for negate, dir_only, regexes in reversed(self.groups)]
+
+    def __bool__(self):
+        return bool(self.groups)
+
+    def excluded(self, rel_path, is_dir=False):
+        if os.sep != '/':
+            rel_path = rel_path.replace(os.sep, '/')
+        for negate, dir_only, regex in self.groups:
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(rel_path):
+                return not negate
+        return False
+
+def source_filter(source, rules=(), default_excludes=True):
+    """PathFilter for a scan of source: the defaults, then the rules in the source's own
+    IGNORE_FILE, then the job's rules (later rules win)"""
+    lines = list(DEFAULT_EXCLUDES) if default_excludes else []
+    lines += load_rules(os.path.join(source, IGNORE_FILE))
+    lines += list(rules or [])
+    return PathFilter(lines)
@@ -0,0 +1,51 @@
+from verify import confirm_algorithm, hash_file
+
+# How far a stored mtime may drift from the original, in seconds, per filesystem
+FS_MTIME_TOLERANCE = {
+    'vfat': 2.0, 'fat': 2.0, 'fat16': 2.0, 'fat32': 2.0, 'msdos': 2.0,
+    'exfat': 2.0, 'fuseblk': 2.0,    # fuseblk is exfat-fuse or ntfs-3g - either way the 2 s applies
+    'hfs': 1.0, 'hfsplus': 1.0, 'udf': 1.0, 'iso9660': 1.0,
+}
+
+# Filesystems that store local time, so timestamps jump by whole hours on TZ/DST changes.
+# Not fuseblk: it may be NTFS, which stores UTC, and a real one-hour change must not be skipped
+LOCAL_TIME_FILESYSTEMS = {'vfat', 'fat', 'fat16', 'fat32', 'msdos', 'exfat'}
+LOCAL_TIME_SHIFTS = (3600.0,)
+
+####################### ===== TimestampComparator ===== #######################
+class TimestampComparator:
+    """Decides whether a target file differs from its source, per filesystem type.
+
+    The tolerance is that of the coarsest filesystem involved (2 s on FAT/exFAT),
+    and on local-time filesystems an exact one-hour offset is treated as a DST/timezone
+    shift rather than a change. With hash_confirm, equal-size files that still look
+    changed are hashed on both sides (xxh3 where available), so identical data is
+    never copied again.
+    """
+    def __init__(self, fstypes=(), hash_confirm=False):
+        fstypes = [fstype.lower() for fstype in fstypes if fstype]
+        self.tolerance = max([FS_MTIME_TOLERANCE.get(fstype, 0.0) for fstype in fstypes] or [0.0])
+        self.local_time = any(fstype in LOCAL_TIME_FILESYSTEMS for fstype in fstypes)
+        self.hash_confirm = hash_confirm
+        self.algorithm = confirm_algorithm()
+
+    def mtime_matches(self, src_mtime, dst_mtime):
+        """True if the target is at least as new as the source, within the tolerance"""
+        if src_mtime <= dst_mtime + self.tolerance:
+            return True
+        if self.local_time:
+            drift = abs(src_mtime - dst_mtime)
+            return any(abs(drift - shift) <= self.tolerance for shift in LOCAL_TIME_SHIFTS)
+        return False
+
+    def needs_copy(self, src_path, size, mtime, dst_path, dst_stat):
+        if size != dst_stat.st_size:
+            return True
+        if self.mtime_matches(mtime, dst_stat.st_mtime):
+            return False
+        if self.hash_confirm:
+            try:
+                return hash_file(src_path, self.algorithm) != hash_file(dst_path, self.algorithm)
+            except OSError:
+                return True
+        return True
@@ -0,0 +1,160 @@
+import os
+import json
+import uuid
+import sqlite3
+import threading
+
+HISTORY_FILE = "backup_history.jsonl"
+LEGACY_HISTORY_FILE = "backup_history.json"
+MANIFESTS_DIR = "backup_manifests"
+PATH_INDEX_FILE = "backup_paths.sqlite"
+
+# Per-file lists of a backup record; kept out of the history file and loaded on demand
+DETAIL_KEYS = ('backed_up_files', 'manifest', 'new_files', 'linked_files',
+               'packed_files', 'created_files', 'checksums', 'verify_failures')
+
+def _dump(data):
+    return json.dumps(data, separators=(',', ':'))
+
+####################### ===== HistoryRecord ===== #######################
+class HistoryRecord(dict):
+    """A backup record whose file lists are read from its manifest on first access"""
+    def __init__(self, summary, store):
+        super().__init__(summary)
+        self.store = store
+        self.details_loaded = not summary.get('details')
+
+    def load_details(self):
+        if not self.details_loaded:
+            self.details_loaded = True
+            self.update(self.store.load_details(self))
+
+    def __missing__(self, key):
+        if key in DETAIL_KEYS and not self.details_loaded:
+            self.load_details()
+            return self[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if key in DETAIL_KEYS:
+            self.load_details()
+        return super().__contains__(key)
+
+####################### ===== HistoryStore ===== #######################
+class HistoryStore:
+    """Append-only backup history with lazily loaded per-snapshot file lists.
+
+    Every backup appends one compact summary line to backup_history.jsonl; its file
+    lists go to backup_manifests/<id>.json and are only read when a record's lists
+    are accessed. Startup therefore parses summaries only, and recording a backup
+    no longer rewrites the whole history.
+    """
+    def __init__(self, directory='.'):
+        self.path = os.path.join(directory, HISTORY_FILE)
+        self.legacy_path = os.path.join(directory, LEGACY_HISTORY_FILE)
+        self.manifests_dir = os.path.join(directory, MANIFESTS_DIR)
+        self.path_index_file = os.path.join(directory, PATH_INDEX_FILE)
+        self.path_index = None
+        self.path_index_lock = threading.Lock()
+
+    def load(self):
+        """All records (summaries only), oldest first; migrates the old JSON history once"""
+        if not os.path.exists(self.path) and os.path.exists(self.legacy_path):
+            self.migrate()
+
+        records = []
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(HistoryRecord(json.loads(line), self))
+                    except ValueError:
+                        # A torn last line after a crash - the rest of the history is intact
+                        continue
+        return records
+
+    def append(self, backup_info):
+        """Store a new backup record and return its lightweight HistoryRecord"""
+        with open(self.path, 'a') as f:
+            return self._write(backup_info, f)
+
+    def _write(self, backup_info, f):
+        record_id = f"{backup_info['timestamp']}_{uuid.uuid4().hex[:8]}"
+        summary = {key: value for key, value in backup_info.items() if key not in DETAIL_KEYS}
+        details = {key: backup_info[key] for key in DETAIL_KEYS if key in backup_info}
+        summary['id'] = record_id
+
+        if details:
+            os.makedirs(self.manifests_dir, exist_ok=True)
+            summary['details'] = f"{record_id}.json"
+            with open(os.path.join(self.manifests_dir, summary['details']), 'w') as manifest_file:
+                manifest_file.write(_dump(details))
+
+        f.write(_dump(summary) + '\n')
+        self._index_paths(record_id, details)
+        return HistoryRecord(summary, self)
+
+    def load_details(self, record):
+        try:
+            with open(os.path.join(self.manifests_dir, record['details']), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Cannot read backup manifest {record['details']}: {e}")
+            return {}
+
+    def migrate(self):
+        """One-time conversion of the old monolithic backup_history.json"""
+        with open(self.legacy_path, 'r') as f:
+            legacy = json.load(f)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for backup_info in legacy:
+                self._write(backup_info, f)
+        # The new history only appears once it is complete
+        os.replace(tmp_path, self.path)
+        os.replace(self.legacy_path, self.legacy_path + '.migrated')
+        print(f"Migrated {len(legacy)} backup records to {self.path}")
+
+    def _open_path_index(self):
+        if self.path_index is None:
+            self.path_index = sqlite3.connect(self.path_index_file, check_same_thread=False)
+            self.path_index.execute("CREATE TABLE IF NOT EXISTS paths (record_id TEXT, path TEXT)")
+            self.path_index.execute("CREATE TABLE IF NOT EXISTS indexed (record_id TEXT PRIMARY KEY)")
+        return self.path_index
+
+    def _index_paths(self, record_id, details):
+        """Add the file paths of one backup to the search index"""
+        paths = list(details.get('backed_up_files', [])) + list(details.get('packed_files', []))
+        with self.path_index_lock:
+            db = self._open_path_index()
+            with db:
+                db.executemany("INSERT INTO paths VALUES (?, ?)", ((record_id, path) for path in paths))
+                db.execute("INSERT OR IGNORE INTO indexed VALUES (?)", (record_id,))
+
+    def search(self, records, text, limit=1000):
+        """Ids of the records (newest first) with a backed-up path containing text.
+
+        Records written before the search index existed are indexed on the first search.
+        """
+        with self.path_index_lock:
+            db = self._open_path_index()
+            indexed = {row[0] for row in db.execute("SELECT record_id FROM indexed")}
+        for record in records:
+            if record.get('id') and record['id'] not in indexed and record.get('details'):
+                self._index_paths(record['id'], self.load_details(record))
+
+        pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        with self.path_index_lock:
+            rows = self._open_path_index().execute(
+                "SELECT DISTINCT record_id FROM paths WHERE path LIKE ? ESCAPE '\\' "
+                "ORDER BY record_id DESC LIMIT ?", (pattern, limit))
+            return [row[0] for row in rows]
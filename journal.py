@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from fastcopy import FALLBACK_ERRNOS
+
+JOURNAL_DIR = ".usb_sync_journal"
+JOURNAL_FLUSH_RECORDS = 64         # Records buffered before the journal is written out
+JOURNAL_FLUSH_SECONDS = 2.0        # ... or this long after the first unwritten record
+CHECKPOINT_BYTES = 64 * 1024 * 1024    # A file in progress is checkpointed every this many bytes
+RESUME_BUFFER_SIZE = 1024 * 1024
+
+def _fsync_path(path):
+    try:
+        fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+####################### ===== TransferJournal ===== #######################
+class TransferJournal:
+    """Checkpoint journal of one job on one target, kept on the target itself.
+
+    Every line is a small JSON record: ["F", rel, size, mtime] for a finished file,
+    ["P", rel, size, mtime, offset] for the durable part of the file in progress and
+    ["M", key, value] for job metadata. Records are buffered and flushed in batches;
+    finished files are fsync'ed before their record is written, so the journal never
+    claims more than is on the device. A restarted job with the same job name reads
+    the journal back and skips or continues confirmed work. complete() removes it.
+    """
+    def __init__(self, target, job, flush_records=JOURNAL_FLUSH_RECORDS,
+                 flush_seconds=JOURNAL_FLUSH_SECONDS):
+        key = hashlib.sha1(job.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(target, JOURNAL_DIR, f"{key}.jnl")
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        self.done = {}       # rel_path -> (size, mtime)
+        self.partial = {}    # rel_path -> (size, mtime, offset)
+        self.meta = {}
+        self.pending = []    # (record, path to fsync first or None)
+        self.first_pending = None
+        self.saved_bytes = 0    # Bytes this run did not have to copy again
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn last line after an unplug - everything before it is valid
+                    continue
+                if record[0] == 'F':
+                    self.done[record[1]] = (record[2], record[3])
+                    self.partial.pop(record[1], None)
+                elif record[0] == 'P':
+                    self.partial[record[1]] = (record[2], record[3], record[4])
+                elif record[0] == 'M':
+                    self.meta[record[1]] = record[2]
+
+    @property
+    def resumed(self):
+        return bool(self.done or self.partial)
+
+    def resume_offset(self, rel_path, size, mtime, dst_path):
+        """Bytes of rel_path already confirmed at dst_path: size if finished, 0 to start over"""
+        with self.lock:
+            done = self.done.get(rel_path)
+            partial = self.partial.get(rel_path)
+        try:
+            on_disk = os.path.getsize(dst_path)
+        except OSError:
+            return 0
+
+        offset = 0
+        if done == (size, mtime) and on_disk == size:
+            offset = size
+        elif partial and partial[:2] == (size, mtime):
+            offset = min(partial[2], on_disk)
+        with self.lock:
+            self.saved_bytes += offset
+        return offset
+
+    def set_meta(self, key, value):
+        self.meta[key] = value
+        self._add(['M', key, value], None, force=True)
+
+    def mark_done(self, rel_path, size, mtime, dst_path):
+        self._add(['F', rel_path, size, mtime], dst_path)
+
+    def checkpoint(self, rel_path, size, mtime, offset):
+        """Record that the first offset bytes of rel_path are durable (the caller fsync'ed them)"""
+        self._add(['P', rel_path, size, mtime, offset], None, force=True)
+
+    def _add(self, record, sync_path, force=False):
+        with self.lock:
+            self.pending.append((record, sync_path))
+            if self.first_pending is None:
+                self.first_pending = time.monotonic()
+        self.flush(force)
+
+    def flush(self, force=True):
+        with self.lock:
+            if not self.pending:
+                return
+            if not force and len(self.pending) < self.flush_records and \
+                    time.monotonic() - self.first_pending < self.flush_seconds:
+                return
+            pending, self.pending = self.pending, []
+            self.first_pending = None
+
+            for _, sync_path in pending:
+                if sync_path:
+                    _fsync_path(sync_path)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(record, separators=(',', ':')) + '\n'
+                                    for record, _ in pending))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                # The target is gone; the job itself reports the failure
+                print(f"Cannot write transfer journal {self.path}: {e}")
+
+    def close(self):
+        self.flush()
+
+    def complete(self):
+        """The job finished - nothing to resume any more"""
+        with self.lock:
+            self.pending = []
+        try:
+            os.remove(self.path)
+            os.rmdir(os.path.dirname(self.path))
+        except OSError:
+            pass
+
+def resume_copy(src_path, dst_path, offset=0, on_checkpoint=None,
+                checkpoint_bytes=CHECKPOINT_BYTES, buffer_size=RESUME_BUFFER_SIZE, hasher=None):
+    """Copy src_path to dst_path starting at offset, keeping the first offset bytes of dst_path.
+
+    Every checkpoint_bytes the destination is fsync'ed and on_checkpoint(position) is
+    called, so a journal can record how far the copy got. With a hasher (see
+    verify.new_hasher) the whole file is hashed, the kept prefix read from the source
+    like FanOutCopier does, so the caller can verify the result; without one the data
+    moves with copy_file_range where the kernel supports it. Returns the bytes written.
+    """
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    written = 0
+    since_checkpoint = 0
+    with open(src_path, 'rb', buffering=0) as src, \
+            open(dst_path, 'r+b' if offset else 'wb', buffering=0) as dst:
+        dst.truncate(offset)
+        if hasher:
+            remaining = offset
+            while remaining > 0:
+                read = src.readinto(view[:min(remaining, buffer_size)])
+                if not read:
+                    break
+                hasher.update(view[:read])
+                remaining -= read
+        src.seek(offset)
+        dst.seek(offset)
+        position = offset
+        kernel = hasher is None and hasattr(os, 'copy_file_range')
+        while True:
+            if kernel:
+                try:
+                    # Explicit offsets leave the file positions alone
+                    read = os.copy_file_range(src.fileno(), dst.fileno(), checkpoint_bytes - since_checkpoint,
+                                              position, position)
+                except OSError as e:
+                    if e.errno not in FALLBACK_ERRNOS:
+                        raise
+                    read = None
+                if not read:
+                    # Unsupported, or 0 returned: the buffered copy reads on and confirms the end
+                    kernel = False
+                    src.seek(position)
+                    dst.seek(position)
+                    continue
+            else:
+                read = src.readinto(buffer)
+                if read and hasher:
+                    hasher.update(view[:read])
+                done = 0
+                while done < read:
+                    done += dst.write(view[done:read])
+            if not read:
+                break
+            position += read
+            written += read
+            since_checkpoint += read
+            if since_checkpoint >= checkpoint_bytes:
+                if on_checkpoint:
+                    os.fsync(dst.fileno())
+                    on_checkpoint(position)
+                since_checkpoint = 0
+    return written
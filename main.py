@@ -1,6 +1,7 @@
 # 1. installing a virtual environment   python -m venv venv
 # 2. activation                         venv\Scripts\activate 
 # 3. Installing libraries               pip install ... (psutil, sv_ttk)                                                                                                         )
+# Without a display (kiosk, scripts):  python cli.py --help
 
 import os
 import sys
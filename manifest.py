@@ -0,0 +1,87 @@
+import os
+import stat
+from collections import namedtuple
+
+# One regular file of a scanned tree; rel_path is relative to the scanned root
+ManifestEntry = namedtuple('ManifestEntry', ['rel_path', 'size', 'mtime', 'mode'])
+
+####################### ===== Manifest ===== #######################
+class Manifest:
+    """Result of a single os.scandir pass over a source tree.
+
+    Counting, copying, syncing and backups all run from the same manifest, so the
+    tree is scanned (and every file stat'ed) exactly once per operation.
+    """
+    def __init__(self, root, entries, pruned=None):
+        self.root = root
+        self.entries = entries
+        self.total_bytes = sum(entry.size for entry in entries)
+        # Directories and files left out by the scan's filter; pruned directories were not entered
+        self.pruned = pruned or {'dirs': 0, 'files': 0}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @property
+    def total_files(self):
+        return len(self.entries)
+
+    def source_path(self, entry):
+        return os.path.join(self.root, entry.rel_path)
+
+    def to_record(self):
+        """JSON-friendly {rel_path: [size, mtime]} mapping, stored with each backup"""
+        return {entry.rel_path: [entry.size, entry.mtime] for entry in self.entries}
+
+def scan_tree(root, path_filter=None):
+    """Scan root with os.scandir and return a Manifest of all regular files.
+
+    Like os.walk, symlinked directories are not followed and unreadable
+    subdirectories are skipped; an unreadable root raises OSError. Entries that
+    path_filter (a filters.PathFilter) excludes are skipped without a stat, and
+    excluded directories are never entered.
+    """
+    entries = []
+    pruned = {'dirs': 0, 'files': 0}
+    excluded = path_filter.excluded if path_filter else None
+    pending = ['']
+    first = True
+
+    while pending:
+        rel_dir = pending.pop()
+        try:
+            iterator = os.scandir(os.path.join(root, rel_dir) if rel_dir else root)
+        except OSError:
+            if first:
+                raise
+            continue
+        first = False
+
+        subdirs = []
+        with iterator:
+            for entry in iterator:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if excluded and excluded(rel_path, True):
+                            pruned['dirs'] += 1
+                        else:
+                            subdirs.append(rel_path)
+                        continue
+                    if excluded and excluded(rel_path, False):
+                        pruned['files'] += 1
+                        continue
+                    # The stat result is cached by scandir (no extra syscall on Windows)
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if stat.S_ISREG(st.st_mode):
+                    entries.append(ManifestEntry(rel_path, st.st_size, st.st_mtime, st.st_mode))
+
+        # Reversed so that directories are visited in listing order, like os.walk
+        pending.extend(reversed(subdirs))
+
+    return Manifest(root, entries, pruned)
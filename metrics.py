@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+
+METRICS_ENV = "USB_SYNC_METRICS"    # Directory for the reports; metrics are off when unset
+PROMETHEUS_FILE = "usb_sync.prom"
+PROMETHEUS_PREFIX = "usb_sync"
+# Upper bounds in seconds of the latency histogram buckets (+Inf is implicit)
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+MAX_ERRORS_KEPT = 100
+
+class _NullTimer:
+    """Returned by Metrics.phase()/time() when metrics are off: no clock reads, no locking"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    __slots__ = ('metrics', 'name', 'histogram', 'start')
+
+    def __init__(self, metrics, name, histogram):
+        self.metrics = metrics
+        self.name = name
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.name, time.perf_counter() - self.start, self.histogram)
+        return False
+
+class _Job:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.metrics.start_job(self.name)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.end_job(self.name)
+        return False
+
+####################### ===== Metrics ===== #######################
+class Metrics:
+    """Process-wide phase timers, per-target counters and copy latency histograms.
+
+    Code on the hot paths wraps work in `with METRICS.phase('scan'):` (total time per
+    phase) or `with METRICS.time('copy_file'):` (total time plus a latency histogram)
+    and reports bytes with count(). While disabled every call returns after a single
+    attribute check. The outermost job() resets the numbers at its start and, at its
+    end, writes a JSON report for the job and a Prometheus textfile with the same values.
+    """
+    def __init__(self, directory=None):
+        self.lock = threading.Lock()
+        self.directory = directory
+        self.enabled = bool(directory)
+        self.job_depth = 0
+        self.reset()
+
+    def configure(self, directory):
+        """Turn metrics on (reports go to directory) or off (None)"""
+        self.directory = directory
+        self.enabled = bool(directory)
+
+    def reset(self):
+        with self.lock:
+            self.job_name = None
+            self.job_start = time.time()
+            self.phases = {}        # name -> [seconds, calls]
+            self.histograms = {}    # name -> [bucket counts..., +Inf count]
+            self.targets = {}       # target -> {'files': n, 'bytes': n, 'errors': n}
+            self.errors = []
+
+    def phase(self, name):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, False)
+
+    def time(self, name):
+        """Like phase(), also recording the latency of every call in a histogram"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, True)
+
+    def record(self, name, seconds, histogram=False):
+        if not self.enabled:
+            return
+        with self.lock:
+            phase = self.phases.setdefault(name, [0.0, 0])
+            phase[0] += seconds
+            phase[1] += 1
+            if histogram:
+                buckets = self.histograms.setdefault(name, [0] * (len(LATENCY_BUCKETS) + 1))
+                buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def count(self, target, files=0, nbytes=0):
+        if not self.enabled:
+            return
+        with self.lock:
+            counters = self.targets.setdefault(target, {'files': 0, 'bytes': 0, 'errors': 0})
+            counters['files'] += files
+            counters['bytes'] += nbytes
+
+    def error(self, target, message):
+        """Count an error against target and keep its message for the report"""
+        if not self.enabled:
+            return
+        with self.lock:
+            counters = self.targets.setdefault(target, {'files': 0, 'bytes': 0, 'errors': 0})
+            counters['errors'] += 1
+            if len(self.errors) < MAX_ERRORS_KEPT:
+                self.errors.append({'target': target, 'message': str(message), 'time': time.time()})
+
+    def job(self, name):
+        """Context manager around a whole job (transfer, sync, backup); nested jobs are folded in"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Job(self, name)
+
+    def job_function(self, name):
+        """Decorator running a function as job(name)"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.job(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def start_job(self, name):
+        with self.lock:
+            self.job_depth += 1
+            outermost = self.job_depth == 1
+        if outermost:
+            self.reset()
+            self.job_name = name
+
+    def end_job(self, name):
+        with self.lock:
+            self.job_depth -= 1
+            outermost = self.job_depth == 0
+        if outermost:
+            try:
+                self.export()
+            except OSError as e:
+                print(f"Cannot write metrics to {self.directory}: {e}")
+
+    def report(self):
+        with self.lock:
+            return {
+                'job': self.job_name,
+                'started': self.job_start,
+                'seconds': time.time() - self.job_start,
+                'phases': {name: {'seconds': seconds, 'calls': calls}
+                           for name, (seconds, calls) in self.phases.items()},
+                'latency_buckets': list(LATENCY_BUCKETS),
+                'histograms': {name: list(buckets) for name, buckets in self.histograms.items()},
+                'targets': {target: dict(counters) for target, counters in self.targets.items()},
+                'errors': list(self.errors)
+            }
+
+    def prometheus(self, report=None):
+        """The report in the Prometheus text exposition format"""
+        report = report or self.report()
+        p = PROMETHEUS_PREFIX
+        job = _label(report['job'] or '')
+        lines = [f"# TYPE {p}_job_seconds gauge",
+                 f'{p}_job_seconds{{job="{job}"}} {report["seconds"]:.6f}',
+                 f"# TYPE {p}_job_start_timestamp_seconds gauge",
+                 f'{p}_job_start_timestamp_seconds{{job="{job}"}} {report["started"]:.3f}',
+                 f"# TYPE {p}_phase_seconds gauge"]
+        # Every metric family is written as one contiguous group
+        for name, phase in report['phases'].items():
+            lines.append(f'{p}_phase_seconds{{job="{job}",phase="{_label(name)}"}} {phase["seconds"]:.6f}')
+        lines.append(f"# TYPE {p}_phase_calls gauge")
+        for name, phase in report['phases'].items():
+            lines.append(f'{p}_phase_calls{{job="{job}",phase="{_label(name)}"}} {phase["calls"]}')
+
+        for key in ('files', 'bytes', 'errors'):
+            lines.append(f"# TYPE {p}_target_{key} gauge")
+            for target, counters in report['targets'].items():
+                lines.append(f'{p}_target_{key}{{job="{job}",target="{_label(target)}"}} {counters[key]}')
+
+        lines.append(f"# TYPE {p}_call_latency_seconds histogram")
+        for name, buckets in report['histograms'].items():
+            labels = f'job="{job}",call="{_label(name)}"'
+            cumulative = 0
+            for bound, count in zip(list(LATENCY_BUCKETS) + ['+Inf'], buckets):
+                cumulative += count
+                lines.append(f'{p}_call_latency_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{p}_call_latency_seconds_sum{{{labels}}} {report["phases"][name]["seconds"]:.6f}')
+            lines.append(f'{p}_call_latency_seconds_count{{{labels}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self):
+        """Write <job>_<timestamp>.json and the Prometheus textfile into the metrics directory"""
+        if not self.directory:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        report = self.report()
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(report['started']))
+        json_path = os.path.join(self.directory, f"{report['job']}_{stamp}.json")
+        with open(json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        # Written under a temporary name - the textfile collector must never see half a file
+        prom_path = os.path.join(self.directory, PROMETHEUS_FILE)
+        with open(prom_path + '.tmp', 'w') as f:
+            f.write(self.prometheus(report))
+        os.replace(prom_path + '.tmp', prom_path)
+        return json_path
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+METRICS = Metrics(os.environ.get(METRICS_ENV))
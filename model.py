@@ -1,22 +1,51 @@
 import os
-import time
 import shutil
 import psutil
 import threading
-from tkinter import *
+from types import SimpleNamespace
 from BackupManager import BackupManager
+from copy_engine import FanOutCopier
+from manifest import ManifestEntry
+from delta import DELTA_MIN_SIZE, sync_file
+from fs_compare import TimestampComparator
+from file_index import FileIndex, device_identity, device_stamp
+from monitor import DeviceMonitor
+from progress import ProgressEstimator, counting_callback
+from verify import resolve_algorithm, verify_copy
+from journal import TransferJournal
+from capacity import check_target, new_span_id, plan_span, read_span_set, write_span_manifest
+from metrics import METRICS
+from workers import DeviceWorkerPool, MAX_WORKERS_PER_DEVICE, group_by_device, physical_device
 
 ####################### ===== USBModel ===== #######################
 class USBModel:
-    def __init__(self):
+    def __init__(self, max_workers_per_device=MAX_WORKERS_PER_DEVICE, sync_backup_mode='full',
+                 use_index=True, hash_confirm=False, delta_min_size=DELTA_MIN_SIZE, verify=None,
+                 device_provider=None, filter_rules=None):
         self.connected_devices = []
+        # Callable returning device dicts like get_usb_devices(); replaces psutil (benchmarks, tests)
+        self.device_provider = device_provider
         self.observer_thread = None
-        self.running = False
-        self.last_check = 0
-        self.backup_manager = BackupManager()
+        # verify (None, 'fast' or 'blake2') hashes every copy while streaming and checks it on the target
+        self.backup_manager = BackupManager(verify=verify)
+        self.set_filters(filter_rules)
+        self.max_workers_per_device = max_workers_per_device
+        self.worker_pool = DeviceWorkerPool(max_workers_per_device)
+        # 'full' backs up the whole source before a sync, 'preimage' only the target files it overwrites
+        self.sync_backup_mode = sync_backup_mode
+        self.use_index = use_index    # Skip per-file target stats for files the device index knows
+        self.hash_confirm = hash_confirm    # Hash equal-size files before re-copying them
+        self.delta_min_size = delta_min_size    # Changed files this large get only their changed blocks rewritten (None = off)
+        self.resumed_bytes = 0    # Bytes the last transfer did not copy again thanks to a journal
+        self.last_capacity = []    # capacity.check_target() results of the last pre-flight check
+        self.last_span_plan = None    # capacity.plan_span() result of the last spanned transfer
+        self.last_pruned = {'dirs': 0, 'files': 0}    # What the filters left out of the last scan
+        self.last_target_errors = {}    # Files that failed per target label in the last transfer or sync
         
     def get_usb_devices(self):
         """Get list of connected USB storage devices with improved detection"""
+        if self.device_provider:
+            return self.device_provider()
         devices = []
         for partition in psutil.disk_partitions():
             # More reliable detection of removable devices
@@ -59,170 +88,540 @@ class USBModel:
             except:
                 return partition.device
     
-    def start_monitoring(self, callback):
-        """Start monitoring USB devices with optimized refresh rate"""
-        self.running = True
-        
-        def observer():
-            last_state = []
-            while self.running:
-                current_time = time.time()
-                # We check devices only once every 10 seconds
-                if current_time - self.last_check > 10:
-                    current_state = self.get_usb_devices()
-                    if current_state != last_state:
-                        last_state = current_state
-                        self.last_check = current_time
-                        callback(current_state)
-                time.sleep(0.1)  # Short sleep to reduce stress
-        
-        self.observer_thread = threading.Thread(target=observer, daemon=True)
+    def _partitions_by_mountpoint(self):
+        if self.device_provider:
+            return {os.path.normpath(device['mountpoint']):
+                    SimpleNamespace(device=device['device'], fstype=device['fstype'])
+                    for device in self.device_provider()}
+        partitions = {}
+        try:
+            for partition in psutil.disk_partitions():
+                partitions[os.path.normpath(partition.mountpoint)] = partition
+        except Exception:
+            pass
+        return partitions
+    
+    def get_physical_devices(self, mountpoints):
+        """Map mount points to the physical device they live on (partitions of one stick share it)"""
+        partitions = self._partitions_by_mountpoint()
+        return [physical_device(partitions[os.path.normpath(mountpoint)].device)
+                if os.path.normpath(mountpoint) in partitions else mountpoint
+                for mountpoint in mountpoints]
+    
+    def get_fstypes(self, mountpoints):
+        """Filesystem type of each mount point, '' when unknown"""
+        partitions = self._partitions_by_mountpoint()
+        return [partitions[os.path.normpath(mountpoint)].fstype
+                if os.path.normpath(mountpoint) in partitions else ''
+                for mountpoint in mountpoints]
+    
+    def set_filters(self, rules=None, default_excludes=True):
+        """Include/exclude rules (filters.PathFilter syntax) for every scan of a source.
+
+        They apply after filters.DEFAULT_EXCLUDES (unless default_excludes is False) and
+        the rules in the source's own .usb_sync_ignore; transfers, syncs and backups share them.
+        """
+        self.backup_manager.filter_rules = list(rules or [])
+        self.backup_manager.default_excludes = default_excludes
+    
+    def scan_source(self, source, progress_callback=None):
+        """Filtered scan of source; reports what the filters pruned to progress_callback"""
+        manifest = self.backup_manager.scan(source)
+        self.last_pruned = manifest.pruned
+        if progress_callback and (manifest.pruned['dirs'] or manifest.pruned['files']):
+            progress_callback(0, f"Filters skipped {manifest.pruned['dirs']} folders and "
+                                 f"{manifest.pruned['files']} files", 0)
+        return manifest
+    
+    def get_free_space(self, mountpoints):
+        """Free bytes on each mount point, as listed by get_usb_devices() (plain directories too)"""
+        free = {os.path.normpath(device['mountpoint']): device['free'] for device in self.get_usb_devices()}
+        result = []
+        for mountpoint in mountpoints:
+            if os.path.normpath(mountpoint) in free:
+                result.append(free[os.path.normpath(mountpoint)])
+                continue
+            try:
+                result.append(shutil.disk_usage(mountpoint).free)
+            except OSError:
+                result.append(0)
+        return result
+    
+    def check_capacity(self, entries, target_dirs):
+        """capacity.check_target() of entries for every (target, target_dir) pair"""
+        targets = [target for target, _ in target_dirs]
+        self.last_capacity = [check_target(entries, target, target_dir, free, fstype)
+                              for (target, target_dir), free, fstype
+                              in zip(target_dirs, self.get_free_space(targets), self.get_fstypes(targets))]
+        return self.last_capacity
+    
+    def _scan_job_source(self, source, progress_callback, empty_message="No files to transfer"):
+        """Manifest of source for a job, None (reported to progress_callback) when there is nothing to do"""
+        if not os.path.exists(source):
+            progress_callback(0, f"Source device {source} not accessible", 0)
+            return None
+        try:
+            with METRICS.phase('scan'):
+                manifest = self.scan_source(source, progress_callback)
+        except Exception as e:
+            progress_callback(0, f"Cannot scan source: {str(e)}", 0)
+            return None
+        if len(manifest) == 0:
+            progress_callback(100, empty_message, 0)
+            return None
+        return manifest
+    
+    def _target_dirs(self, source, targets, progress_callback):
+        """(target, <target>/<source name>) for every accessible target"""
+        target_dirs = []
+        for target in targets:
+            if not os.path.exists(target):
+                progress_callback(0, f"Target {target} not accessible", 0)
+                continue
+            target_dirs.append((target, os.path.join(target, os.path.basename(source.rstrip(os.sep)))))
+        return target_dirs
+    
+    def _file_done_reporter(self, estimator, progress_callback, targets, message):
+        """FanOutCopier on_file_done that feeds estimator, METRICS and progress_callback.
+
+        targets maps the copier's target index to the estimator's target; message(target)
+        is the progress text.
+        """
+        progress_lock = threading.Lock()
+        
+        def on_file_done(index, dst_path, error, nbytes, size):
+            target = targets[index]
+            if error:
+                print(f"Error copying to {dst_path}: {error}")
+                METRICS.error(target, error)
+                estimator.file_done(target, size or 0, 0, skipped=True)
+                return
+            METRICS.count(target, 1, nbytes)
+            # A file a journal confirmed entirely was not copied - nothing to learn from it
+            estimator.file_done(target, size or 0, nbytes, skipped=bool(size) and not nbytes)
+            
+            progress, remaining, files, copied = estimator.snapshot()
+            with progress_lock:
+                progress_callback(progress, message(target), remaining, files=files, nbytes=copied)
+        return on_file_done
+    
+    def start_monitoring(self, callback, source=None):
+        """Start monitoring USB devices; callback(added, removed) receives the changes.
+
+        source defaults to mount table notifications where available, with polling as fallback.
+        """
+        if self.observer_thread and self.observer_thread.is_alive():
+            return  # Already running - never start a second observer
+        
+        self.observer_thread = DeviceMonitor(self.get_usb_devices, callback, source)
         self.observer_thread.start()
     
     def stop_monitoring(self):
         """Stop monitoring USB devices"""
-        self.running = False
         if self.observer_thread:
-            self.observer_thread.join(timeout=1)
+            self.observer_thread.stop()
+            self.observer_thread.join(timeout=2)
     
+    @METRICS.job_function('transfer')
     def transfer_data(self, source, targets, progress_callback):
-        """Improved data transfer with better error handling"""
-        total_files = 0
-        copied_files = 0
-        start_time = time.time()
-        success_targets = []
+        """Improved data transfer with better error handling.
+
+        progress_callback(progress, message, remaining, files=None, nbytes=None) may be
+        called from worker threads; files and nbytes are the cumulative counts of the job.
+        """
+        progress_callback = counting_callback(progress_callback)
+        self.last_capacity = []
+        self.last_target_errors = {}
         
-        # Checking the availability of the source device
-        if not os.path.exists(source):
-            progress_callback(0, f"Source device {source} not accessible", 0)
+        # Scanning the source once; every target is served from this manifest
+        manifest = self._scan_job_source(source, progress_callback)
+        if manifest is None:
+            return []
+        
+        target_dirs = self._target_dirs(source, targets, progress_callback)
+        if not target_dirs:
+            return []
+        
+        # Targets the data cannot fit on are dropped before anything is written
+        with METRICS.phase('capacity'):
+            checks = self.check_capacity(manifest.entries, target_dirs)
+        for check in checks:
+            if not check['fits']:
+                print(f"Transfer rejected: {check['problem']}")
+                progress_callback(0, check['problem'], 0)
+        target_dirs = [target_dir for target_dir, check in zip(target_dirs, checks) if check['fits']]
+        if not target_dirs:
+            if len(checks) > 1:
+                progress_callback(0, "No target can hold the whole source - spanning mode splits it "
+                                     "across the targets", 0)
             return []
         
-        # Counting files with error handling
+        # A journal on every target lets an interrupted transfer continue where it stopped
+        journals = []
+        for target, target_dir in target_dirs:
+            journal = TransferJournal(target, f"transfer|{os.path.abspath(source)}|{target_dir}")
+            if journal.resumed:
+                progress_callback(0, f"Resuming interrupted transfer to {os.path.basename(target)}", 0)
+            journals.append(journal)
+        
+        # Progress and ETA follow the bytes, with the per-file overhead measured separately
+        estimator = ProgressEstimator(len(manifest), manifest.total_bytes, [target for target, _ in target_dirs])
+        for target, _ in target_dirs:
+            estimator.start(target)
+        on_file_done = self._file_done_reporter(estimator, progress_callback, [target for target, _ in target_dirs],
+                                                lambda target: f"Copying to  {os.path.basename(target)}...")
+        
+        # Each source file is read once and written to all targets concurrently
         try:
-            for root, _, files in os.walk(source):
-                total_files += len(files)
+            groups = group_by_device(self.get_physical_devices([target for target, _ in target_dirs]),
+                                     self.max_workers_per_device)
+            algorithm = resolve_algorithm(self.backup_manager.verify)
+            fstypes = self.get_fstypes([target for target, _ in target_dirs]) if algorithm else None
+            with FanOutCopier([target_dir for _, target_dir in target_dirs], on_file_done, groups,
+                              hash_algorithm=algorithm, fstypes=fstypes, journals=journals) as copier:
+                for entry in manifest:
+                    # Includes the wait for buffers, i.e. time the slowest target holds the reader back
+                    with METRICS.time('read_file'):
+                        copier.copy(manifest.source_path(entry), entry.rel_path, entry.size, entry.mtime)
         except Exception as e:
-            progress_callback(0, f"Cannot scan source: {str(e)}", 0)
+            print(f"Error during transfer from {source}: {e}")
+            METRICS.error(source, e)
+            for journal in journals:
+                journal.close()
             return []
         
-        if total_files == 0:
-            progress_callback(100, "No files to transfer", 0)
+        self.last_target_errors = {os.path.basename(target): errors
+                                   for (target, _), errors in zip(target_dirs, copier.target_errors)}
+        
+        # Journals of targets that received everything are no longer needed
+        for journal, errors in zip(journals, copier.target_errors):
+            if errors:
+                journal.close()
+            else:
+                journal.complete()
+        
+        self.resumed_bytes = sum(journal.saved_bytes for journal in journals)
+        if self.resumed_bytes:
+            progress_callback(100, f"Transfer resumed: {self.resumed_bytes / (1024 * 1024):.1f} MB "
+                                   f"were already on the targets", 0)
+        
+        return [os.path.basename(target) for target, _ in target_dirs]
+
+    @METRICS.job_function('span')
+    def span_data(self, source, targets, progress_callback):
+        """Spread a source too large for any single target across all targets.
+
+        Every file goes to exactly one target (see capacity.plan_span), into the usual
+        <target>/<source name> folder, next to a span manifest listing that part of the
+        set; reassemble_span() puts the parts back together. Returns the labels of the
+        targets that received their complete part, or [] when the plan is impossible.
+        """
+        progress_callback = counting_callback(progress_callback)
+        self.last_span_plan = None
+        manifest = self._scan_job_source(source, progress_callback)
+        if manifest is None:
             return []
         
-        # Copy to each target device
-        for target in targets:
+        target_dirs = self._target_dirs(source, targets, progress_callback)
+        
+        # The whole set is planned before anything is written
+        with METRICS.phase('capacity'):
+            mountpoints = [target for target, _ in target_dirs]
+            plan = plan_span(manifest.entries, [
+                {'target': target, 'target_dir': target_dir, 'free': free, 'fstype': fstype}
+                for (target, target_dir), free, fstype
+                in zip(target_dirs, self.get_free_space(mountpoints), self.get_fstypes(mountpoints))])
+        self.last_span_plan = plan
+        if not plan['ok']:
+            for problem in plan['problems']:
+                print(f"Spanning rejected: {problem}")
+                progress_callback(0, problem, 0)
+            return []
+        
+        parts = plan['parts']
+        span_id = new_span_id()
+        algorithm = resolve_algorithm(self.backup_manager.verify)
+        estimator = ProgressEstimator(0, 0, [part['target'] for part in parts],
+                                      work={part['target']: (len(part['entries']), part['bytes'])
+                                            for part in parts})
+        
+        def span_part(numbered):
+            number, part = numbered
+            target = part['target']
+            estimator.start(target)
+            on_file_done = self._file_done_reporter(
+                estimator, progress_callback, [target],
+                lambda target: f"Spanning part {number}/{len(parts)} to {os.path.basename(target)}...")
+            
             try:
-                # Checking the availability of the target device
-                if not os.path.exists(target):
-                    progress_callback(0, f"Target {target} not accessible", 0)
-                    continue
-                
-                # Creating a target directory
-                target_dir = os.path.join(target, os.path.basename(source.rstrip(os.sep)))
-                
-                # Copying files
-                for root, dirs, files in os.walk(source):
-                    for file in files:
-                        src_path = os.path.join(root, file)
-                        rel_path = os.path.relpath(root, source)
-                        dst_path = os.path.join(target_dir, rel_path, file)
-                        
-                        try:
-                            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-                            shutil.copy2(src_path, dst_path)
-                            copied_files += 1
-                            
-                            # Progress update
-                            progress = (copied_files / (total_files * len(targets))) * 100
-                            elapsed = time.time() - start_time
-                            remaining = (elapsed / max(1, progress)) * (100 - progress) if progress > 0 else 0
-                            progress_callback(progress, f"Copying to  {os.path.basename(target)}...", remaining)
-                            
-                        except Exception as e:
-                            print(f"Error copying {src_path} to {dst_path}: {e}")
-                            continue
-                
-                success_targets.append(os.path.basename(target))
-                
+                with FanOutCopier([part['target_dir']], on_file_done, hash_algorithm=algorithm,
+                                  fstypes=[part['fstype']]) as copier:
+                    for entry in part['entries']:
+                        with METRICS.time('read_file'):
+                            copier.copy(manifest.source_path(entry), entry.rel_path, entry.size, entry.mtime)
+                if copier.target_errors[0]:
+                    return None
+                # Written last: a part with a manifest is a complete part
+                write_span_manifest(part, number, parts, source, span_id)
+                return os.path.basename(target)
             except Exception as e:
-                print(f"Error during transfer to {target}: {e}")
-                continue
+                print(f"Error during spanning to {target}: {e}")
+                METRICS.error(target, e)
+                estimator.skip_rest(target)
+                return None
         
-        return success_targets
+        results = self.worker_pool.map(span_part, list(enumerate(parts, 1)),
+                                       self.get_physical_devices([part['target'] for part in parts]))
+        return [result for result in results if result]
+    
+    @METRICS.job_function('reassemble')
+    def reassemble_span(self, part_dirs, destination, progress_callback):
+        """Copy the parts of a spanned transfer (their <target>/<source name> folders) back
+        into destination/<source name>; returns that folder, or None when the set is
+        incomplete or does not fit"""
+        progress_callback = counting_callback(progress_callback)
+        manifests, problems = read_span_set(part_dirs)
+        if not manifests:
+            problems.append("No span manifest found")
+        
+        entries = []
+        sources = []
+        for manifest in manifests:
+            for rel_path, (size, mtime) in manifest['files'].items():
+                entries.append(ManifestEntry(rel_path, size, mtime, 0))
+                sources.append(os.path.join(manifest['dir'], rel_path))
+        
+        target_dir = os.path.join(destination, manifests[0]['source']) if manifests else destination
+        if not problems:
+            check = self.check_capacity(entries, [(destination, target_dir)])[0]
+            if not check['fits']:
+                problems.append(check['problem'])
+        if problems:
+            for problem in problems:
+                print(f"Reassembly rejected: {problem}")
+                progress_callback(0, problem, 0)
+            return None
+        
+        total_bytes = sum(entry.size for entry in entries)
+        estimator = ProgressEstimator(len(entries), total_bytes, [destination])
+        estimator.start(destination)
+        on_file_done = self._file_done_reporter(estimator, progress_callback, [destination],
+                                                lambda target: f"Reassembling {manifests[0]['source']}...")
+        
+        algorithm = resolve_algorithm(self.backup_manager.verify)
+        with FanOutCopier([target_dir], on_file_done, hash_algorithm=algorithm,
+                          fstypes=self.get_fstypes([destination])) as copier:
+            for entry, src_path in zip(entries, sources):
+                copier.copy(src_path, entry.rel_path, entry.size, entry.mtime)
+        return None if copier.target_errors[0] else target_dir
+
+    def open_index(self, target):
+        """Open the sync index of the device at target, dropping it if the device changed behind our back"""
+        index = FileIndex(device_identity(target))
+        if index.get_stamp() != device_stamp(target):
+            index.invalidate()
+        return index
+    
+    def invalidate_index(self, target):
+        """Forget the synced state of a device that was modified outside the tool.
+
+        Needed after edits the device stamp cannot see (see file_index.device_stamp).
+        """
+        with FileIndex(device_identity(target)) as index:
+            index.invalidate()
+    
+    def rollback(self, backup_info):
+        """Undo the sync a pre-image backup was taken for (see BackupManager.rollback).
+
+        The index of the target is dropped as well: the restored files may differ from
+        the synced ones within the same cluster, which the device stamp does not notice.
+        """
+        restored = self.backup_manager.rollback(backup_info)
+        self.invalidate_index(os.path.dirname(os.path.normpath(backup_info['restore_root'])))
+        return restored
+    
+    def plan_sync(self, manifest, target_dir, indexed=None, comparator=None):
+        """Files of manifest that a sync to target_dir must copy, as {rel_path: destination_exists}
 
+        Files whose size and mtime match the device index are taken as unchanged without a stat;
+        the others are checked with comparator (a TimestampComparator for the filesystems involved).
+        """
+        changes = {}
+        indexed = indexed or {}
+        comparator = comparator or TimestampComparator(hash_confirm=self.hash_confirm)
+        for entry in manifest:
+            known = indexed.get(entry.rel_path)
+            if known and known[0] == entry.size and known[1] == entry.mtime:
+                continue
+            
+            # The source side comes from the manifest, only the target is stat'ed
+            dst_path = os.path.join(target_dir, entry.rel_path)
+            try:
+                dst_stat = os.stat(dst_path)
+            except OSError:
+                changes[entry.rel_path] = False
+                continue
+            
+            if comparator.needs_copy(manifest.source_path(entry), entry.size, entry.mtime,
+                                     dst_path, dst_stat):
+                changes[entry.rel_path] = True
+        return changes
+    
+    @METRICS.job_function('sync')
     def sync_with_backup(self, source, targets, progress_callback):
-        total_files = 0
-        copied_files = 0
-        start_time = time.time()
+        """Sync source into every target after backing it up; progress_callback as in transfer_data"""
+        progress_callback = counting_callback(progress_callback)
         success_targets = []
         
-        if not os.path.exists(source):
-            progress_callback(0, f"Source device {source} not accessible", 0)
+        self.last_target_errors = {}
+        manifest = self._scan_job_source(source, progress_callback, "No files to synchronize")
+        if manifest is None:
             return []
+        total_files = len(manifest)
         
-        try:
-            for root, _, files in os.walk(source):
-                total_files += len(files)
-        except Exception as e:
-            progress_callback(0, f"Cannot scan source: {str(e)}", 0)
-            return []
+        progress_lock = threading.Lock()
+        estimator = ProgressEstimator(total_files, manifest.total_bytes, targets)
         
-        if total_files == 0:
-            progress_callback(100, "No files to synchronize", 0)
-            return []
+        # The change check is tuned to the coarsest timestamps of source and target filesystem
+        source_fstype = self.get_fstypes([source])[0]
+        fstypes = dict(zip(targets, self.get_fstypes(targets)))
+        free_space = dict(zip(targets, self.get_free_space(targets)))
         
-        for target in targets:
+        def sync_target(target):
             try:
                 if not os.path.exists(target):
                     progress_callback(0, f"Target {target} not accessible", 0)
-                    continue
+                    estimator.skip_rest(target)
+                    return None
+                
+                target_dir = os.path.join(target, os.path.basename(source.rstrip(os.sep)))
+                os.makedirs(target_dir, exist_ok=True)
+                
+                with METRICS.phase('index'):
+                    index = self.open_index(target) if self.use_index else None
+                    index_root = os.path.basename(target_dir)
+                    indexed = index.load(index_root) if index else {}
+                
+                # Deciding up front which files will be copied and which of them overwrite something
+                comparator = TimestampComparator((source_fstype, fstypes[target]), self.hash_confirm)
+                with METRICS.phase('plan'):
+                    changes = self.plan_sync(manifest, target_dir, indexed, comparator)
                 
-                backup_info = self.backup_manager.create_backup(source, target)
+                # The copies plus the backup written before them must fit, checked before either starts
+                with METRICS.phase('capacity'):
+                    changed = [entry for entry in manifest if entry.rel_path in changes]
+                    if self.sync_backup_mode == 'preimage':
+                        backed_up = [entry for entry in changed if changes[entry.rel_path]]
+                    elif self.backup_manager.incremental:
+                        backed_up = changed
+                    else:
+                        backed_up = manifest.entries
+                    check = check_target(changed, target, target_dir, free_space[target], fstypes[target],
+                                         also=backed_up)
+                if not check['fits']:
+                    print(f"Sync rejected: {check['problem']}")
+                    progress_callback(0, check['problem'], 0)
+                    estimator.skip_rest(target)
+                    if index:
+                        index.close()
+                    return None
+                
+                if self.sync_backup_mode == 'preimage':
+                    backup_info = self.backup_manager.create_preimage_backup(
+                        source, target, target_dir,
+                        [rel_path for rel_path, existed in changes.items() if existed],
+                        [rel_path for rel_path, existed in changes.items() if not existed])
+                else:
+                    backup_info = self.backup_manager.create_backup(source, target, manifest)
                 if not backup_info:
                     progress_callback(0, f"Backup failed for {target}", 0)
-                    continue
+                    estimator.skip_rest(target)
+                    if index:
+                        index.close()
+                    return None
+                # The backup is not part of the copy timing
+                estimator.start(target)
                 
-                target_dir = os.path.join(target, os.path.basename(source.rstrip(os.sep)))
-                os.makedirs(target_dir, exist_ok=True)
+                target_copied = 0
+                copy_methods = {}
+                failed = set()
+                
+                # Source checksums of a full backup are reused to verify the sync without hashing again
+                algorithm = resolve_algorithm(self.backup_manager.verify)
+                checksums = {}
+                if (algorithm and backup_info.get('mode') in ('full', 'incremental') and
+                        backup_info.get('checksum_algorithm') == algorithm):
+                    checksums = dict(backup_info.get('checksums') or {})
                 
-                for root, dirs, files in os.walk(source):
-                    for file in files:
-                        src_path = os.path.join(root, file)
-                        rel_path = os.path.relpath(root, source)
-                        dst_path = os.path.join(target_dir, rel_path, file)
-                        
-                        copy_needed = True
-                        
-                        if os.path.exists(dst_path):
-                            src_stat = os.stat(src_path)
-                            dst_stat = os.stat(dst_path)
-                            
-                            if (src_stat.st_size == dst_stat.st_size and 
-                                src_stat.st_mtime <= dst_stat.st_mtime):
-                                copy_needed = False
-                        
-                        if copy_needed:
-                            try:
+                for entry in manifest:
+                    src_path = manifest.source_path(entry)
+                    dst_path = os.path.join(target_dir, entry.rel_path)
+                    copy_needed = entry.rel_path in changes
+                    
+                    if copy_needed:
+                        try:
+                            with METRICS.phase('makedirs'):
                                 os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-                                shutil.copy2(src_path, dst_path)
-                                copied_files += 1
-                            except Exception as e:
-                                print(f"Error copying {src_path} to {dst_path}: {e}")
-                                continue
-                        
-                        progress = (copied_files / total_files) * 100
-                        elapsed = time.time() - start_time
-                        remaining = (elapsed / max(1, progress)) * (100 - progress) if progress > 0 else 0
-                        status_msg = f"Syncing to {os.path.basename(target)}: {copied_files} files"
-                        progress_callback(progress, status_msg, remaining)
+                            digest = checksums.get(entry.rel_path)
+                            with METRICS.time('sync_file'):
+                                written, method, streamed = sync_file(src_path, dst_path, entry.size,
+                                                                      self.delta_min_size,
+                                                                      algorithm=None if digest else algorithm)
+                            if algorithm:
+                                digest = digest or streamed
+                                checksums[entry.rel_path] = digest
+                                with METRICS.time('verify'):
+                                    verify_copy(dst_path, digest, algorithm, fstypes[target])
+                            METRICS.count(target, 1, written)
+                            copy_methods[method] = copy_methods.get(method, 0) + 1
+                            target_copied += 1
+                        except Exception as e:
+                            print(f"Error copying {src_path} to {dst_path}: {e}")
+                            METRICS.error(target, e)
+                            failed.add(entry.rel_path)
+                            estimator.file_done(target, entry.size, 0, skipped=True)
+                            continue
+                        estimator.file_done(target, entry.size, written)
+                    else:
+                        # Unchanged files count as done, so a mostly unchanged sync moves steadily
+                        estimator.file_done(target, entry.size, 0, skipped=True)
+                    
+                    # Progress is aggregated over all targets being synced in parallel
+                    progress, remaining, files, copied = estimator.snapshot()
+                    with progress_lock:
+                        status_msg = f"Syncing to {os.path.basename(target)}: {target_copied} files"
+                        progress_callback(progress, status_msg, remaining, files=files, nbytes=copied)
                 
-                success_targets.append({
+                if index:
+                    # Remembering what is now identical on the device for the next run
+                    def known_hash(entry):
+                        known = indexed.get(entry.rel_path)
+                        if known and known[:2] == (entry.size, entry.mtime) and entry.rel_path not in changes:
+                            return known[2]
+                        return checksums.get(entry.rel_path)
+                    
+                    with METRICS.phase('index'):
+                        index.replace(index_root, ((entry.rel_path, entry.size, entry.mtime, known_hash(entry))
+                                                   for entry in manifest if entry.rel_path not in failed))
+                        index.set_stamp(device_stamp(target))
+                        index.close()
+                
+                return {
                     'target': os.path.basename(target),
-                    'backup_info': backup_info
-                })
+                    'backup_info': backup_info,
+                    'copy_methods': copy_methods,
+                    'errors': len(failed)
+                }
                 
             except Exception as e:
                 print(f"Error during sync to {target}: {e}")
-                continue
+                METRICS.error(target, e)
+                estimator.skip_rest(target)
+                return None
+        
+        # One worker per target, limited per physical device; results keep the target order
+        results = self.worker_pool.map(sync_target, targets, self.get_physical_devices(targets))
+        success_targets = [result for result in results if result]
+        self.last_target_errors = {result['target']: result['errors'] for result in success_targets}
         
         return success_targets
@@ -0,0 +1,117 @@
+import os
+import time
+import select
+import threading
+
+MOUNTINFO = '/proc/self/mountinfo'
+WAIT_TIMEOUT = 1.0        # Longest a source blocks, so stop() is honoured quickly
+POLL_INTERVAL = 2.0       # Rescan period of the polling fallback
+RESCAN_INTERVAL = 10.0    # Full rescan even without events, to pick up free space changes
+
+####################### ===== Mount table sources ===== #######################
+class MountinfoSource:
+    """Wakes up when the kernel changes the mount table (POLLPRI on /proc/self/mountinfo)"""
+    def __init__(self, path=MOUNTINFO):
+        self.file = open(path, 'rb')
+        self.file.read()    # Consume the current table so only later changes are reported
+        self.poller = select.poll()
+        self.poller.register(self.file.fileno(), select.POLLPRI | select.POLLERR)
+
+    @staticmethod
+    def available(path=MOUNTINFO):
+        return hasattr(select, 'poll') and os.path.exists(path)
+
+    def wait(self, timeout):
+        """Block up to timeout seconds; True if the mount table changed"""
+        if not self.poller.poll(timeout * 1000):
+            return False
+        # Reading the table again re-arms the notification
+        self.file.seek(0)
+        self.file.read()
+        return True
+
+    def close(self):
+        self.file.close()
+
+class PollingSource:
+    """Fallback for systems without mountinfo notifications: reports a change every interval"""
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.last = time.monotonic()
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        if time.monotonic() - self.last >= self.interval:
+            self.last = time.monotonic()
+            return True
+        return False
+
+    def close(self):
+        pass
+
+def default_source():
+    if MountinfoSource.available():
+        try:
+            return MountinfoSource()
+        except OSError:
+            pass
+    return PollingSource()
+
+def diff_devices(old, new):
+    """(added, removed) between two device lists, keyed by mount point.
+
+    A device whose details changed (e.g. free space) is reported in added only,
+    replacing the previous entry for the same mount point.
+    """
+    old_by_mount = {device['mountpoint']: device for device in old}
+    new_by_mount = {device['mountpoint']: device for device in new}
+    added = [device for mountpoint, device in new_by_mount.items()
+             if old_by_mount.get(mountpoint) != device]
+    removed = [device for mountpoint, device in old_by_mount.items()
+               if mountpoint not in new_by_mount]
+    return added, removed
+
+####################### ===== DeviceMonitor ===== #######################
+class DeviceMonitor(threading.Thread):
+    """Rescans devices when the mount table source reports a change and emits diffs.
+
+    get_devices returns the current device list and callback(added, removed) receives
+    the differences; the first scan reports every device as added. Any object with
+    wait(timeout) and close() can serve as the source, e.g. a fake mount table.
+    """
+    def __init__(self, get_devices, callback, source=None, rescan_interval=RESCAN_INTERVAL):
+        super().__init__(daemon=True)
+        self.get_devices = get_devices
+        self.callback = callback
+        self.source = source or default_source()
+        self.rescan_interval = rescan_interval
+        self.stop_event = threading.Event()
+        self.devices = []
+
+    def check(self):
+        try:
+            current = self.get_devices()
+        except Exception as e:
+            print(f"Device scan failed: {e}")
+            return
+        added, removed = diff_devices(self.devices, current)
+        self.devices = current
+        if added or removed:
+            self.callback(added, removed)
+
+    def run(self):
+        last_scan = time.monotonic()
+        try:
+            self.check()
+            while not self.stop_event.is_set():
+                changed = self.source.wait(WAIT_TIMEOUT)
+                if self.stop_event.is_set():
+                    break
+                if changed or time.monotonic() - last_scan >= self.rescan_interval:
+                    last_scan = time.monotonic()
+                    self.check()
+        finally:
+            self.source.close()
+
+    def stop(self):
+        self.stop_event.set()
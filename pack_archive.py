@@ -0,0 +1,99 @@
+import os
+import json
+
+PACK_MAX_FILE_SIZE = 1024 * 1024          # Files up to this size go into the archive
+PACK_VOLUME_SIZE = 4 * 1024 ** 3 - 1      # FAT32 cannot hold files of 4 GB or more
+PACK_BUFFER_SIZE = 8 * 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+
+####################### ===== PackWriter ===== #######################
+class PackWriter:
+    """Streams many small files into one archive with a random-access index.
+
+    Contents are appended to <base>.pack.000 (rolling over to .001, ... before the
+    FAT32 size limit), and <base>.pack.idx maps every relative path to its volume,
+    offset, size, mtime and mode. One large sequential write replaces a create,
+    a directory update and a close per file on the target.
+    """
+    def __init__(self, base_path, volume_size=PACK_VOLUME_SIZE):
+        self.base_path = base_path
+        self.volume_size = volume_size
+        self.index_path = base_path + '.pack.idx'
+        self.volumes = []
+        self.files = {}
+        self.current = None
+        self.offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self.current:
+            self.current.close()
+
+    def _next_volume(self):
+        if self.current:
+            self.current.close()
+        name = f"{os.path.basename(self.base_path)}.pack.{len(self.volumes):03d}"
+        self.current = open(os.path.join(os.path.dirname(self.base_path), name), 'wb',
+                            buffering=PACK_BUFFER_SIZE)
+        self.volumes.append(name)
+        self.offset = 0
+
+    def add(self, src_path, rel_path, size, mtime, mode):
+        if self.current is None or self.offset + size > self.volume_size:
+            self._next_volume()
+
+        written = 0
+        with open(src_path, 'rb') as src:
+            while True:
+                chunk = src.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.current.write(chunk)
+                written += len(chunk)
+
+        self.files[rel_path] = [len(self.volumes) - 1, self.offset, written, mtime, mode]
+        self.offset += written
+
+    def close(self):
+        """Flush the last volume and write the index; returns the index path"""
+        if self.current:
+            self.current.close()
+            self.current = None
+
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'volumes': self.volumes, 'files': self.files}, f)
+        os.replace(tmp_path, self.index_path)
+        return self.index_path
+
+####################### ===== PackReader ===== #######################
+class PackReader:
+    """Random access to a PackWriter archive: restoring one file is a single seek"""
+    def __init__(self, index_path):
+        self.directory = os.path.dirname(index_path)
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        self.volumes = index['volumes']
+        self.files = index['files']
+
+    def list_files(self):
+        return list(self.files)
+
+    def read(self, rel_path):
+        volume, offset, size, _, _ = self.files[rel_path]
+        with open(os.path.join(self.directory, self.volumes[volume]), 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def extract(self, rel_path, dst_path):
+        _, _, _, mtime, mode = self.files[rel_path]
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        with open(dst_path, 'wb') as f:
+            f.write(self.read(rel_path))
+        os.chmod(dst_path, mode & 0o7777)
+        os.utime(dst_path, (mtime, mtime))
+        return dst_path
@@ -0,0 +1,226 @@
+import time
+import inspect
+import threading
+from collections import deque
+from metrics import METRICS
+
+FRAME_RATE = 10       # GUI progress redraws per second
+RATE_WINDOW = 3.0     # Seconds of history used for the file and byte rates
+ETA_FORGETTING = 0.98             # Weight kept by older samples per finished file
+DEFAULT_FILE_OVERHEAD = 0.005     # Seconds per file until measured
+DEFAULT_BYTE_RATE = 20 * 1024 * 1024    # Bytes per second until measured (a typical USB 2 stick)
+
+def counting_callback(callback):
+    """Wrap a progress_callback so it can always be called with files= and nbytes=.
+
+    Callbacks written for the plain (progress, message, remaining) signature keep
+    working; the counters are only passed on to callbacks that accept them.
+    """
+    try:
+        parameters = inspect.signature(callback).parameters.values()
+    except (TypeError, ValueError):
+        parameters = []
+    accepts = (any(p.kind == p.VAR_KEYWORD for p in parameters) or
+               {'files', 'nbytes'} <= {p.name for p in parameters})
+    if accepts:
+        return callback
+
+    def plain_callback(progress, message, remaining, files=None, nbytes=None):
+        callback(progress, message, remaining)
+    return plain_callback
+
+####################### ===== ProgressEstimator ===== #######################
+class ProgressEstimator:
+    """Byte-weighted progress and ETA for a job whose files and bytes are known up front.
+
+    Every target's time per file is modelled as overhead + nbytes / rate. Both terms are
+    fitted per target from the measured gaps between finished files, with older samples
+    fading out (forgetting factor), so one huge file after many tiny ones moves the
+    estimate by its bytes rather than as a single file. Skipped files count as done
+    without teaching the model anything. Progress weighs every file as its bytes plus
+    the byte equivalent of the per-file overhead. work maps targets to their own
+    (files, bytes) where they do not all receive the same data.
+    """
+    def __init__(self, total_files, total_bytes, targets=('',), forgetting=ETA_FORGETTING, work=None):
+        self.forgetting = forgetting
+        self.lock = threading.Lock()
+        work = work or {}
+        self.targets = {target: {
+            'files_left': work.get(target, (total_files, total_bytes))[0],
+            'bytes_left': work.get(target, (total_files, total_bytes))[1],
+            'files_done': 0, 'bytes_done': 0, 'copied_bytes': 0,
+            'last': None, 'sums': [0.0] * 5,    # decayed S(1), S(n), S(n*n), S(t), S(n*t)
+            'overhead': DEFAULT_FILE_OVERHEAD, 'rate': DEFAULT_BYTE_RATE,
+        } for target in targets}
+        self.total_files = sum(state['files_left'] for state in self.targets.values())
+        self.total_bytes = sum(state['bytes_left'] for state in self.targets.values())
+
+    def start(self, target=''):
+        """Start the clock of target, e.g. after a backup that ran before its copy phase"""
+        with self.lock:
+            self.targets[target]['last'] = time.monotonic()
+
+    def file_done(self, target, size, copied=None, skipped=False):
+        """A file of size bytes is finished on target; copied is what was actually written"""
+        now = time.monotonic()
+        copied = size if copied is None else copied
+        with self.lock:
+            state = self.targets[target]
+            state['files_left'] -= 1
+            state['bytes_left'] -= size
+            state['files_done'] += 1
+            state['bytes_done'] += size
+            state['copied_bytes'] += copied
+            if state['last'] is not None and not skipped:
+                self._learn(state, copied / (1024 * 1024), now - state['last'])
+            state['last'] = now
+
+    def skip_rest(self, target=''):
+        """Count everything left on target as done, e.g. when the target failed"""
+        with self.lock:
+            state = self.targets[target]
+            state['files_done'] += state['files_left']
+            state['bytes_done'] += state['bytes_left']
+            state['files_left'] = state['bytes_left'] = 0
+
+    def _learn(self, state, megabytes, seconds):
+        """Recursive least squares of seconds = overhead + megabytes / rate with forgetting"""
+        sums = state['sums']
+        for i, value in enumerate((1.0, megabytes, megabytes * megabytes, seconds, megabytes * seconds)):
+            sums[i] = sums[i] * self.forgetting + value
+        s1, sn, snn, st, snt = sums
+
+        det = s1 * snn - sn * sn
+        overhead = per_mb = None
+        if det > 1e-9 * s1 * snn:
+            overhead = (snn * st - sn * snt) / det
+            per_mb = (s1 * snt - sn * st) / det
+        if overhead is None or overhead < 0 or per_mb <= 0:
+            # Sizes too similar to separate the two terms, or a noisy fit: keep the
+            # current rate and fit only the overhead
+            per_mb = 1024 * 1024 / state['rate']
+            overhead = (st - sn * per_mb) / s1
+            if overhead < 0:
+                # Faster than the current rate allows - the bytes alone explain the time
+                overhead, per_mb = 0.0, snt / snn
+        state['overhead'] = overhead
+        if per_mb > 0:
+            state['rate'] = 1024 * 1024 / per_mb
+
+    def _remaining(self, state):
+        return state['files_left'] * state['overhead'] + state['bytes_left'] / state['rate']
+
+    def snapshot(self):
+        """(percent, remaining seconds, files done, bytes done) over all targets"""
+        with self.lock:
+            states = list(self.targets.values())
+            done_units = total_units = 0.0
+            for state in states:
+                # Bytes the target could have moved in the time one file costs in overhead
+                file_units = state['overhead'] * state['rate']
+                done_units += state['bytes_done'] + state['files_done'] * file_units
+                total_units += (state['bytes_done'] + state['bytes_left'] +
+                                (state['files_done'] + state['files_left']) * file_units)
+            percent = done_units / total_units * 100 if total_units else 100.0
+            # Targets run in parallel; the slowest one decides
+            remaining = max((self._remaining(state) for state in states), default=0.0)
+            return (min(percent, 100.0), max(remaining, 0.0),
+                    sum(state['files_done'] for state in states),
+                    sum(state['copied_bytes'] for state in states))
+
+    def rates(self):
+        """{target: (seconds overhead per file, bytes per second)} as currently estimated"""
+        with self.lock:
+            return {target: (state['overhead'], state['rate']) for target, state in self.targets.items()}
+
+####################### ===== ProgressChannel ===== #######################
+class ProgressChannel:
+    """Coalesces progress reports from worker threads for a consumer that polls it.
+
+    Workers call publish() as often as they like; it only stores the latest state per
+    operation type under a short lock, so reporting costs almost nothing. The consumer
+    calls drain() at its own pace and gets one update per operation that changed,
+    including file and byte rates computed from the cumulative counters.
+    """
+    def __init__(self, rate_window=RATE_WINDOW):
+        self.rate_window = rate_window
+        self.lock = threading.Lock()
+        self.latest = {}     # operation_type -> (progress, message, remaining, files, nbytes)
+        self.samples = {}    # operation_type -> deque of (time, files, nbytes)
+        self.calls = deque()    # (func, args, kwargs) to run on the consumer's thread
+
+    def publish(self, progress, message, remaining, operation_type='transfer', files=None, nbytes=None):
+        """files and nbytes are cumulative counts of the current job, if known"""
+        with self.lock:
+            self.latest[operation_type] = (progress, message, remaining, files, nbytes)
+
+    def reporter(self, operation_type='transfer'):
+        """A progress_callback for USBModel that publishes into this channel"""
+        def progress_callback(progress, message, remaining, files=None, nbytes=None):
+            self.publish(progress, message, remaining, operation_type, files, nbytes)
+        return progress_callback
+
+    def call_soon(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) on the consumer's thread at its next run_calls().
+
+        Worker threads use it for everything that touches widgets (log lines, buttons,
+        message boxes), since Tk must only be called from its own thread.
+        """
+        self.calls.append((func, args, kwargs))
+
+    def run_calls(self):
+        """Run the calls queued with call_soon(), in order"""
+        while self.calls:
+            func, args, kwargs = self.calls.popleft()
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                print(f"UI update failed: {e}")
+
+    def _rates(self, operation_type, files, nbytes, now):
+        if files is None and nbytes is None:
+            return None, None
+        files = files or 0
+        nbytes = nbytes or 0
+        samples = self.samples.setdefault(operation_type, deque())
+        if samples and (files < samples[-1][1] or nbytes < samples[-1][2]):
+            samples.clear()    # Counters went back - a new job started
+        samples.append((now, files, nbytes))
+        while len(samples) > 2 and now - samples[0][0] > self.rate_window:
+            samples.popleft()
+
+        start_time, start_files, start_bytes = samples[0]
+        elapsed = now - start_time
+        if elapsed <= 0:
+            return None, None
+        return (files - start_files) / elapsed, (nbytes - start_bytes) / elapsed
+
+    def drain(self):
+        """[(operation_type, progress, message, remaining, file_rate, byte_rate)] since the last drain"""
+        with self.lock:
+            pending, self.latest = self.latest, {}
+
+        now = time.monotonic()
+        updates = []
+        for operation_type, (progress, message, remaining, files, nbytes) in pending.items():
+            file_rate, byte_rate = self._rates(operation_type, files, nbytes, now)
+            updates.append((operation_type, progress, message, remaining, file_rate, byte_rate))
+        return updates
+
+####################### ===== TkProgressPump ===== #######################
+class TkProgressPump:
+    """Drains a ProgressChannel on the Tk thread at a fixed frame rate via root.after,
+    then runs the UI calls the workers queued with call_soon()"""
+    def __init__(self, root, channel, render, frame_rate=FRAME_RATE):
+        self.root = root
+        self.channel = channel
+        self.render = render
+        self.interval = max(1, int(1000 / frame_rate))
+        self.root.after(self.interval, self._tick)
+
+    def _tick(self):
+        with METRICS.phase('gui_update'):
+            for operation_type, progress, message, remaining, file_rate, byte_rate in self.channel.drain():
+                self.render(progress, message, remaining, operation_type, file_rate, byte_rate)
+            self.channel.run_calls()
+        self.root.after(self.interval, self._tick)
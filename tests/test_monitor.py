@@ -0,0 +1,125 @@
+import queue
+import threading
+from monitor import DeviceMonitor, diff_devices
+from model import USBModel
+
+EVENT_TIMEOUT = 5.0
+
+class FakeMountTable:
+    """Mount table source driven by the test: wait() returns True once per trigger()"""
+    def __init__(self):
+        self.changed = threading.Event()
+        self.closed = False
+
+    def trigger(self):
+        self.changed.set()
+
+    def wait(self, timeout):
+        if self.changed.wait(min(timeout, 0.05)):
+            self.changed.clear()
+            return True
+        return False
+
+    def close(self):
+        self.closed = True
+
+def device(mountpoint, free=1000):
+    return {'device': f"/dev/{mountpoint.strip('/')}", 'mountpoint': mountpoint, 'fstype': 'vfat',
+            'total': 4000, 'used': 4000 - free, 'free': free, 'label': mountpoint.strip('/')}
+
+def start_monitor(devices):
+    events = queue.Queue()
+    source = FakeMountTable()
+    monitor = DeviceMonitor(lambda: list(devices), lambda added, removed: events.put((added, removed)),
+                            source, rescan_interval=3600)
+    monitor.start()
+    return monitor, source, events
+
+def test_initial_scan_reports_every_device_as_added():
+    devices = [device('/a'), device('/b')]
+    monitor, source, events = start_monitor(devices)
+    try:
+        added, removed = events.get(timeout=EVENT_TIMEOUT)
+        assert [d['mountpoint'] for d in added] == ['/a', '/b']
+        assert removed == []
+    finally:
+        monitor.stop()
+        monitor.join(EVENT_TIMEOUT)
+
+def test_later_add_and_remove_are_reported_as_diffs():
+    devices = [device('/a')]
+    monitor, source, events = start_monitor(devices)
+    try:
+        events.get(timeout=EVENT_TIMEOUT)
+
+        devices.append(device('/b'))
+        source.trigger()
+        assert events.get(timeout=EVENT_TIMEOUT) == ([device('/b')], [])
+
+        devices.remove(device('/a'))
+        source.trigger()
+        assert events.get(timeout=EVENT_TIMEOUT) == ([], [device('/a')])
+    finally:
+        monitor.stop()
+        monitor.join(EVENT_TIMEOUT)
+
+def test_unchanged_table_emits_nothing():
+    devices = [device('/a')]
+    monitor, source, events = start_monitor(devices)
+    try:
+        events.get(timeout=EVENT_TIMEOUT)
+        source.trigger()
+        try:
+            event = events.get(timeout=0.5)
+        except queue.Empty:
+            event = None
+        assert event is None
+    finally:
+        monitor.stop()
+        monitor.join(EVENT_TIMEOUT)
+
+def test_free_space_change_is_a_re_add():
+    devices = [device('/a', free=1000)]
+    monitor, source, events = start_monitor(devices)
+    try:
+        events.get(timeout=EVENT_TIMEOUT)
+        devices[0] = device('/a', free=500)
+        source.trigger()
+        added, removed = events.get(timeout=EVENT_TIMEOUT)
+        assert added == [device('/a', free=500)]
+        assert removed == []
+    finally:
+        monitor.stop()
+        monitor.join(EVENT_TIMEOUT)
+
+def test_stop_ends_the_thread_and_closes_the_source():
+    monitor, source, events = start_monitor([device('/a')])
+    events.get(timeout=EVENT_TIMEOUT)
+    monitor.stop()
+    monitor.join(EVENT_TIMEOUT)
+    assert not monitor.is_alive()
+    assert source.closed
+
+def test_diff_devices_keys_by_mount_point():
+    old = [device('/a'), device('/b')]
+    new = [device('/b', free=10), device('/c')]
+    added, removed = diff_devices(old, new)
+    assert added == [device('/b', free=10), device('/c')]
+    assert removed == [device('/a')]
+
+def test_start_monitoring_twice_keeps_one_observer():
+    devices = [device('/a')]
+    model = USBModel(device_provider=lambda: list(devices))
+    events = queue.Queue()
+    first, second = FakeMountTable(), FakeMountTable()
+    model.start_monitoring(lambda added, removed: events.put((added, removed)), first)
+    try:
+        observer = model.observer_thread
+        model.start_monitoring(lambda added, removed: events.put((added, removed)), second)
+        assert model.observer_thread is observer
+        assert observer.source is first
+        events.get(timeout=EVENT_TIMEOUT)
+    finally:
+        model.stop_monitoring()
+    assert not model.observer_thread.is_alive()
+    assert first.closed and not second.closed
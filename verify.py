@@ -0,0 +1,122 @@
+import os
+import zlib
+import shutil
+import hashlib
+
+try:
+    import xxhash
+except ImportError:    # Optional - falls back to CRC-32
+    xxhash = None
+
+VERIFY_BUFFER_SIZE = 1024 * 1024
+
+# Filesystems that checksum every data block themselves: after fsync a bad write is
+# caught by the filesystem on the next read, so the destination is not read back
+TRUSTED_FILESYSTEMS = {'btrfs', 'zfs', 'bcachefs'}
+
+class VerifyError(OSError):
+    """The destination does not hold what was read from the source"""
+
+class _Crc32:
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self):
+        return f"{self.value:08x}"
+
+def resolve_algorithm(requested):
+    """Hash actually used for a verify mode: 'fast' (xxh3, or CRC-32 without xxhash) or 'blake2'"""
+    if not requested:
+        return None
+    if requested in ('blake2', 'blake2b'):
+        return 'blake2b'
+    return 'xxh3_128' if xxhash else 'crc32'
+
+def new_hasher(algorithm):
+    if algorithm == 'blake2b':
+        return hashlib.blake2b(digest_size=16)
+    if algorithm == 'sha256':
+        return hashlib.sha256()
+    if algorithm == 'xxh3_128':
+        return xxhash.xxh3_128()
+    return _Crc32()
+
+def filesystem_type(path):
+    """Filesystem type of the mount that holds path, '' when unknown"""
+    try:
+        import psutil
+        path = os.path.realpath(path)
+        best = ('', '')
+        for partition in psutil.disk_partitions(all=True):
+            mountpoint = partition.mountpoint
+            if ((path == mountpoint or path.startswith(mountpoint.rstrip(os.sep) + os.sep))
+                    and len(mountpoint) > len(best[0])):
+                best = (mountpoint, partition.fstype)
+        return best[1].lower()
+    except Exception:
+        return ''
+
+def hash_copy(src_path, dst_path, algorithm, buffer_size=VERIFY_BUFFER_SIZE, copy_metadata=True):
+    """Copy a file through a user-space buffer, hashing the data as it streams past"""
+    hasher = new_hasher(algorithm)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(src_path, 'rb', buffering=0) as src, open(dst_path, 'wb', buffering=0) as dst:
+        while True:
+            read = src.readinto(buffer)
+            if not read:
+                break
+            hasher.update(view[:read])
+            written = 0
+            while written < read:
+                written += dst.write(view[written:read])
+        # The read-back must come from the device, not from dirty pages
+        os.fsync(dst.fileno())
+    if copy_metadata:
+        shutil.copystat(src_path, dst_path)
+    return hasher.hexdigest()
+
+def hash_file(path, algorithm, buffer_size=VERIFY_BUFFER_SIZE, drop_cache=False):
+    """Hash a file with algorithm (see new_hasher); with drop_cache its cached pages are
+    dropped first where possible, so the data comes from the device"""
+    hasher = new_hasher(algorithm)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        if drop_cache and hasattr(os, 'posix_fadvise'):
+            os.fsync(f.fileno())
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            hasher.update(view[:read])
+    return hasher.hexdigest()
+
+def read_back_hash(path, algorithm, buffer_size=VERIFY_BUFFER_SIZE):
+    """Hash a file as stored on the device, not as cached in memory"""
+    return hash_file(path, algorithm, buffer_size, drop_cache=True)
+
+def confirm_algorithm():
+    """Hash for deciding whether two files are equal: xxh3, or BLAKE2b without xxhash
+    (CRC-32 is too weak to skip a copy on)"""
+    return 'xxh3_128' if xxhash else 'blake2b'
+
+def verify_copy(dst_path, digest, algorithm, fstype=''):
+    """Check a written file against the source digest; returns 'verified' or 'trusted'.
+
+    Raises VerifyError when the read-back differs.
+    """
+    if fstype in TRUSTED_FILESYSTEMS:
+        return 'trusted'
+    if read_back_hash(dst_path, algorithm) != digest:
+        raise VerifyError(f"Checksum mismatch after copy: {dst_path}")
+    return 'verified'
+
+def copy_verified(src_path, dst_path, algorithm, fstype=''):
+    """hash_copy() followed by verify_copy(); returns (digest, 'verified' or 'trusted')"""
+    digest = hash_copy(src_path, dst_path, algorithm)
+    return digest, verify_copy(dst_path, digest, algorithm, fstype)
@@ -6,6 +6,62 @@ import tkinter as tk
 from datetime import datetime
 from tkinter import ttk, messagebox, Menu
 
+####################### ===== VirtualList ===== #######################
+class VirtualList(ttk.Frame):
+    """Scrollable list that only renders the visible rows of a (possibly huge) sequence"""
+    def __init__(self, parent, rows=(), height=25):
+        super().__init__(parent)
+        self.rows = rows
+        self.first = 0
+        self.listbox = tk.Listbox(self, height=height, activestyle='none',
+                                  bg='#1a1a2e', fg='#00ff99', font=('Courier New', 9))
+        self.scrollbar = ttk.Scrollbar(self, orient="vertical", command=self.on_scroll)
+        self.listbox.pack(side="left", fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side="right", fill="y")
+        
+        self.listbox.bind("<Configure>", lambda event: self.render())
+        self.listbox.bind("<MouseWheel>", lambda event: self.scroll_by(-3 if event.delta > 0 else 3))
+        self.listbox.bind("<Button-4>", lambda event: self.scroll_by(-3))
+        self.listbox.bind("<Button-5>", lambda event: self.scroll_by(3))
+        self.listbox.bind("<Up>", lambda event: self.scroll_by(-1))
+        self.listbox.bind("<Down>", lambda event: self.scroll_by(1))
+        self.listbox.bind("<Prior>", lambda event: self.scroll_by(-self.visible_count()))
+        self.listbox.bind("<Next>", lambda event: self.scroll_by(self.visible_count()))
+    
+    def set_rows(self, rows):
+        self.rows = rows
+        self.first = 0
+        self.render()
+    
+    def visible_count(self):
+        line_height = max(1, self.listbox.bbox(0)[3] if self.listbox.bbox(0) else 15)
+        return max(1, self.listbox.winfo_height() // line_height) if self.listbox.winfo_height() > 1 \
+            else int(self.listbox['height'])
+    
+    def scroll_by(self, count):
+        self.first += count
+        self.render()
+        return "break"
+    
+    def on_scroll(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.first = int(float(amount) * len(self.rows))
+        elif unit == 'pages':
+            self.first += int(amount) * self.visible_count()
+        else:
+            self.first += int(amount)
+        self.render()
+    
+    def render(self):
+        count = self.visible_count()
+        self.first = max(0, min(self.first, len(self.rows) - count))
+        self.listbox.delete(0, tk.END)
+        visible = self.rows[self.first:self.first + count]
+        if visible:
+            self.listbox.insert(tk.END, *visible)
+        total = max(1, len(self.rows))
+        self.scrollbar.set(self.first / total, min(1.0, (self.first + count) / total))
+
 ####################### ===== USBView ===== #######################
 class USBView:
     def __init__(self, root, controller):
@@ -29,6 +85,7 @@ class USBView:
         file_menu.add_command(label="Start Transfer", command=self.controller.start_transfer)
         file_menu.add_command(label="Start Backup", command=self.controller.start_backup)
         file_menu.add_command(label="Start Sync with Backup", command=self.controller.start_sync_with_backup)
+        file_menu.add_command(label="Reset Sync Index of Targets", command=self.controller.reset_sync_index)
         file_menu.add_separator()
         file_menu.add_command(label="Exit", command=self.root.quit)
         self.menubar.add_cascade(label="File", menu=file_menu)
@@ -349,14 +406,24 @@ class USBView:
         
         self.log_message(f"Devices list updated")
     
-    def update_progress(self, progress, message, remaining_time, operation_type='transfer'):
-        """Updates progress depending on the type of operation"""
+    def format_rates(self, file_rate, byte_rate):
+        if file_rate is None and byte_rate is None:
+            return ""
+        return f"  |  {(byte_rate or 0) / (1024 ** 2):.1f} MB/s, {file_rate or 0:.0f} files/s"
+    
+    def update_progress(self, progress, message, remaining_time, operation_type='transfer',
+                        file_rate=None, byte_rate=None):
+        """Updates progress depending on the type of operation.
+
+        Must run on the Tk thread - worker threads publish into the controller's ProgressChannel.
+        """
+        rates = self.format_rates(file_rate, byte_rate)
         if operation_type == 'backup':
             self.backup_progress['value'] = progress
             self.backup_label.config(text=message)
             if remaining_time > 0:
                 mins, secs = divmod(int(remaining_time), 60)
-                self.backup_time.config(text=f"Backup time remaining: {mins:02d}:{secs:02d}")
+                self.backup_time.config(text=f"Backup time remaining: {mins:02d}:{secs:02d}{rates}")
             else:
                 if progress >= 100:
                     self.backup_time.config(text="Backup completed")
@@ -367,11 +434,9 @@ class USBView:
             self.transfer_label.config(text=message)
             if remaining_time > 0:
                 mins, secs = divmod(int(remaining_time), 60)
-                self.transfer_time.config(text=f"Transfer time remaining: {mins:02d}:{secs:02d}")
+                self.transfer_time.config(text=f"Transfer time remaining: {mins:02d}:{secs:02d}{rates}")
             else:
                 self.transfer_time.config(text="Transfer time remaining: --")
-        
-        self.root.update_idletasks()
 
     def log_message(self, message):
         timestamp = datetime.now().strftime("%H:%M:%S")
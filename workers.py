@@ -0,0 +1,58 @@
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+MAX_WORKERS_PER_DEVICE = 1    # Concurrent jobs allowed on one physical device
+
+def physical_device(device):
+    """Strip the partition suffix from a partition device (/dev/sdb1 -> /dev/sdb)"""
+    match = re.match(r'^(/dev/(?:nvme\d+n\d+|mmcblk\d+|loop\d+))p\d+$', device)
+    if match:
+        return match.group(1)
+    match = re.match(r'^(/dev/(?:sd|hd|vd|xvd)[a-z]+)\d+$', device)
+    if match:
+        return match.group(1)
+    match = re.match(r'^(/dev/disk\d+)s\d+$', device)  # macOS
+    if match:
+        return match.group(1)
+    return device
+
+def group_by_device(keys, max_workers_per_device=MAX_WORKERS_PER_DEVICE):
+    """Split item indices into worker groups, at most max_workers_per_device per device"""
+    per_device = {}
+    for index, key in enumerate(keys):
+        per_device.setdefault(key, []).append(index)
+
+    groups = []
+    for indices in per_device.values():
+        count = min(len(indices), max(1, max_workers_per_device))
+        groups.extend(indices[i::count] for i in range(count))
+    return groups
+
+####################### ===== DeviceWorkerPool ===== #######################
+class DeviceWorkerPool:
+    """Runs one job per target in parallel, limiting concurrent jobs per physical device"""
+    def __init__(self, max_workers_per_device=MAX_WORKERS_PER_DEVICE):
+        self.max_workers_per_device = max(1, max_workers_per_device)
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def slot(self, device_key):
+        with self.lock:
+            if device_key not in self.slots:
+                self.slots[device_key] = threading.Semaphore(self.max_workers_per_device)
+            return self.slots[device_key]
+
+    def _run(self, func, item, device_key):
+        with self.slot(device_key):
+            return func(item)
+
+    def map(self, func, items, device_keys):
+        """Call func for every item and return the results in the order of items"""
+        if not items:
+            return []
+
+        with ThreadPoolExecutor(max_workers=len(items)) as executor:
+            futures = [executor.submit(self._run, func, item, key)
+                       for item, key in zip(items, device_keys)]
+            return [future.result() for future in futures]